@@ -1,22 +1,12 @@
-
-import os
-from aiohttp_retry import ExponentialRetry
-
-import jinja2
-from dotenv import load_dotenv
-from .cache_db import SQLiteCacheBackend
-
-cache = SQLiteCacheBackend('medium_db_cache.sqlite')
-retry_options = ExponentialRetry(attempts=3)
-
 from . import exceptions as exceptions
 from . import exceptions as medium_parser_exceptions
+from .context import MediumParserContext, configure, get_context, set_context
 
-jinja_env = jinja2.Environment(enable_async=True)
-
-load_dotenv()
-
-MEDIUM_AUTH_COOKIES = os.getenv("MEDIUM_AUTH_COOKIES")
 
-if not MEDIUM_AUTH_COOKIES:
-    raise ValueError("No auth cookies for Medium was found. Paywalled content doesn't will be available!!! Check MEDIUM_AUTH_COOKIES variable")
+def __getattr__(name: str):
+    # Shared resources used to be created on import. Keep them reachable, but resolve lazily from default context
+    if name in ("cache", "retry_options", "jinja_env"):
+        return getattr(get_context(), name)
+    if name == "MEDIUM_AUTH_COOKIES":
+        return get_context().auth_cookies
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
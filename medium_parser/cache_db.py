@@ -1,12 +1,74 @@
-from typing import Union
+from typing import Iterator, Optional, Union
 import sqlite3
 import json
+import random
+import re
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from html import escape
 from warnings import warn
-try:
-    import sqlite_zstd
-except ImportError:
-    warn("Can't use zstd compression. Please install 'sqlite_zstd' package")
-    sqlite_zstd = None
+
+from loguru import logger
+
+from .search import SNIPPET_CLOSE, SNIPPET_OPEN, extract_search_document, highlight_snippet, quote_search_query, search_rowid
+
+
+@lru_cache(maxsize=None)
+def load_sqlite_zstd():
+    # Loaded on first connection instead of import, since it's a heavy native extension
+    try:
+        import sqlite_zstd
+    except ImportError:
+        warn("Can't use zstd compression. Please install 'sqlite_zstd' package")
+        return None
+    return sqlite_zstd
+
+
+# Tables with up to this many rows are sampled with ORDER BY RANDOM(), which is cheap enough for them
+RANDOM_ORDER_MAX_ROWS = 10_000
+# Rowid probes per requested row before giving up on sparse table
+RANDOM_PROBES_PER_ROW = 8
+# Sampled rows are read by this many keys per query, below SQLite's limit of query parameters
+RANDOM_FETCH_BATCH = 500
+# First refresh of pushed post is due after this share of its age (time since `updatedAt`), clamped to
+# [INITIAL_REFRESH_DELAY, MAX_INITIAL_REFRESH_DELAY] and spread over 1-2 times that, so bulk loads don't come due at
+# once. Same as `CacheRefresher` defaults, which reschedules post by its own settings after the first refresh
+INITIAL_REFRESH_AGE_FACTOR = 0.1
+INITIAL_REFRESH_DELAY = 3600
+MAX_INITIAL_REFRESH_DELAY = 30 * 86400
+UPDATED_AT_PATTERN = re.compile(r'"updatedAt": ?(\d+)')
+
+
+# Schedule first refresh of pushed post, keeping schedule of posts which are already scheduled
+SCHEDULE_PUSHED_QUERY = "INSERT OR IGNORE INTO refresh_schedule VALUES (:key, 0, :post_updated_at, :now, :next_refresh_at)"
+
+
+def post_updated_at(value: Union[dict, str]) -> Optional[float]:
+    """
+    `updatedAt` of post payload in seconds, None if payload isn't a post. Serialized payloads (e.g. loaded from
+    snapshot) aren't parsed: post's own `updatedAt` is the first one in FullPostQuery response, nested objects before
+    it don't have one.
+    """
+    if isinstance(value, dict):
+        updated_at = ((value.get("data") or {}).get("post") or {}).get("updatedAt")
+        return updated_at / 1000 if isinstance(updated_at, (int, float)) else None
+
+    match = UPDATED_AT_PATTERN.search(value)
+    return int(match.group(1)) / 1000 if match else None
+
+
+def first_refresh(key: str, value: Union[dict, str], now: float) -> dict:
+    """
+    First refresh schedule row of pushed post, posts of unknown age get the shortest delay.
+    """
+    updated_at = post_updated_at(value)
+    delay = INITIAL_REFRESH_DELAY
+    if updated_at is not None:
+        delay = min(max((now - updated_at) * INITIAL_REFRESH_AGE_FACTOR, INITIAL_REFRESH_DELAY), MAX_INITIAL_REFRESH_DELAY)
+
+    return {'key': key, 'post_updated_at': updated_at, 'now': now, 'next_refresh_at': now + delay * (1 + random.random())}
+
 
 class CacheResponse:
     __slots__ = ('data')
@@ -22,19 +84,378 @@ class CacheResponse:
     def __str__(self):
         return self.data
 
-class SQLiteCacheBackend:
-    __slots__ = ('connection', 'cursor')
-    def __init__(self, database: str):
+
+class RenderedCacheResponse(CacheResponse):
+    __slots__ = ('compressed')
+    def __init__(self, data: str, compressed: dict):
+        super().__init__(data)
+        self.compressed = compressed
+
+
+def serialize_value(value: Union[dict, str]) -> str:
+    if isinstance(value, dict):
+        return json.dumps(value)
+    elif not isinstance(value, str):
+        raise ValueError(f"value argument should be only string type not {type(value).__name__}")
+    return value
+
+
+def rendered_key(post_id: str, *variant) -> str:
+    # Rendered variants of a post are keyed with post ID prefix, so backends can route them next to the post
+    return ":".join((post_id, *map(str, variant)))
+
+
+def rendered_key_post_id(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+class CacheBackend:
+    """
+    Interface of cache backends. `MediumParser` works with any of them through `MediumParserContext.cache`.
+    """
+    __slots__ = ()
+
+    def init_db(self) -> None:
+        raise NotImplementedError
+
+    def all(self) -> list:
+        raise NotImplementedError
+
+    def all_length(self) -> int:
+        raise NotImplementedError
+
+    def random(self, size: int) -> list:
+        raise NotImplementedError
+
+    def iter_items(self, page_size: int = 500, since: float = None) -> Iterator[tuple]:
+        """
+        Yield (key, value) rows, fetching `page_size` rows at a time. With `since`, only rows pushed at or after
+        that Unix time.
+        """
+        raise NotImplementedError
+
+    def iter_keys(self, page_size: int = 5000) -> Iterator[str]:
+        raise NotImplementedError
+
+    def keys(self) -> list:
+        return list(self.iter_keys())
+
+    def stats(self, measure_disk: bool = False) -> dict:
+        """
+        Row count and total size of uncompressed values in bytes, without reading values. With `measure_disk`, also
+        size of cache table on disk and compression ratio between the two; measuring may walk every page of the table,
+        so it's meant for occasional maintenance, not for every metrics scrape. Size on disk and ratio are None if not
+        measured or backend can't measure them.
+        """
+        raise NotImplementedError
+
+    def pull(self, key: str) -> CacheResponse:
+        raise NotImplementedError
+
+    def push(self, key: str, value: Union[dict, str]) -> None:
+        raise NotImplementedError
+
+    def push_many(self, items: list) -> None:
+        for key, value in items:
+            self.push(key, value)
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def replace_post(self, key: str, value: Union[dict, str]) -> None:
+        """
+        Store fresh post payload and drop its rendered variants atomically.
+        """
+        raise NotImplementedError
+
+    def replace_posts(self, items: list, rendered_rows: list = ()) -> None:
+        """
+        Store fresh (key, value) post payloads, drop their rendered variants and then store (key, post_id, value,
+        compressed) rendered rows rendered from the fresh payloads, atomically.
+        """
+        for key, value in items:
+            self.replace_post(key, value)
+        self.push_rendered_many(rendered_rows)
+
+    def pull_rendered(self, key: str) -> RenderedCacheResponse:
+        raise NotImplementedError
+
+    def push_rendered(self, key: str, post_id: str, value: Union[dict, str], compressed: dict = None) -> None:
+        raise NotImplementedError
+
+    def delete_rendered(self, post_id: str) -> None:
+        raise NotImplementedError
+
+    def delete_rendered_many(self, post_ids: list) -> None:
+        for post_id in post_ids:
+            self.delete_rendered(post_id)
+
+    def push_rendered_many(self, rows: list) -> None:
+        """
+        Store (key, post_id, value, compressed) rows.
+        """
+        for key, post_id, value, compressed in rows:
+            self.push_rendered(key, post_id, value, compressed)
+
+    def iter_rendered(self, page_size: int = 500) -> Iterator[tuple]:
+        """
+        Yield (key, post_id, value, compressed) rows of rendered output.
+        """
+        raise NotImplementedError
+
+    def pull_media_resource(self, key: str) -> CacheResponse:
+        raise NotImplementedError
+
+    def push_media_resources(self, post_id: str, items: list) -> None:
+        """
+        Store (key, value) media resources of iframes embedded in post.
+        """
+        raise NotImplementedError
+
+    def delete_media_resources(self, post_id: str) -> None:
+        raise NotImplementedError
+
+    @contextmanager
+    def bulk_load(self, defer_indexes: bool = True):
+        """
+        Context for loading many rows with `push_many` and `push_rendered_many`. With `defer_indexes`, backends may
+        defer index maintenance until it exits, so indexed lookups are slow inside of it.
+        """
+        yield self
+        self.flush()
+
+    def pull_negative(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def push_negative(self, key: str, reason: str, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete_negative(self, key: str) -> None:
+        raise NotImplementedError
+
+    def pull_refresh_schedule(self, keys: list) -> dict:
+        """
+        Map of key to (hits, post_updated_at, refreshed_at, next_refresh_at) for scheduled keys.
+        """
+        raise NotImplementedError
+
+    def push_refresh_schedule(self, rows: list) -> None:
+        """
+        Store (key, hits, post_updated_at, refreshed_at, next_refresh_at) rows. Pushed posts are scheduled by backend
+        itself, with unknown (None) `post_updated_at`.
+        """
+        raise NotImplementedError
+
+    def add_refresh_hits(self, hits: dict) -> None:
+        """
+        Add hits of scheduled posts, so refresh schedule is weighted by popularity seen by every process.
+        """
+        raise NotImplementedError
+
+    def due_refreshes(self, now: float, limit: int) -> list:
+        raise NotImplementedError
+
+    def claim_refreshes(self, schedule: dict, lease_until: float) -> list:
+        """
+        Atomically move `next_refresh_at` of due keys to `lease_until`, if it's still what `schedule` (map of key to
+        `next_refresh_at` seen by caller) says. Returns keys claimed by this call, so concurrent refreshers never
+        refresh the same post, and a post claimed by crashed refresher comes due again after lease.
+        """
+        raise NotImplementedError
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, raw: bool = False) -> list:
+        """
+        Find cached posts matching all words of `query`, best matches first. Returns dicts with key, title, snippet
+        and rank (lower is better). Title and snippet are both HTML-escaped, ready to be put into a page, with matches
+        in snippet wrapped in <mark>. `raw=True` passes FTS5 query syntax as is.
+        """
+        raise NotImplementedError
+
+    def rebuild_search_index(self) -> int:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    In-process cache backend. Not shared between processes and not persistent, meant for tests and local runs.
+    """
+    __slots__ = ('_cache', '_pushed_at', '_rendered', '_media_resources', '_negative', '_refresh_schedule')
+
+    def __init__(self):
+        self._cache = {}
+        self._pushed_at = {}
+        self._rendered = {}
+        self._media_resources = {}
+        self._negative = {}
+        self._refresh_schedule = {}
+
+    def init_db(self) -> None:
+        pass
+
+    def all(self) -> list:
+        return list(self._cache.items())
+
+    def all_length(self) -> int:
+        return len(self._cache)
+
+    def random(self, size: int) -> list:
+        return random.sample(self.all(), min(size, len(self._cache)))
+
+    def iter_items(self, page_size: int = 500, since: float = None) -> Iterator[tuple]:
+        yield from [(key, value) for key, value in self._cache.items() if since is None or self._pushed_at[key] >= since]
+
+    def iter_keys(self, page_size: int = 5000) -> Iterator[str]:
+        yield from list(self._cache)
+
+    def stats(self, measure_disk: bool = False) -> dict:
+        total_bytes = sum(len(value.encode("utf-8")) for value in self._cache.values())
+        return {"rows": len(self._cache), "untracked_rows": 0, "total_bytes": total_bytes, "disk_bytes": total_bytes, "compression_ratio": 1.0}
+
+    def pull(self, key: str) -> CacheResponse:
+        if key in self._cache:
+            return CacheResponse(self._cache[key])
+
+    def push(self, key: str, value: Union[dict, str]) -> None:
+        now = time.time()
+        self._cache[key] = serialize_value(value)
+        self._pushed_at[key] = now
+        if key not in self._refresh_schedule:
+            row = first_refresh(key, value, now)
+            self._refresh_schedule[key] = (0, row['post_updated_at'], now, row['next_refresh_at'])
+
+    def delete(self, key: str) -> None:
+        self._cache.pop(key, None)
+        self._pushed_at.pop(key, None)
+        self._refresh_schedule.pop(key, None)
+
+    def replace_post(self, key: str, value: Union[dict, str]) -> None:
+        self.push(key, value)
+        self.delete_rendered(key)
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, raw: bool = False) -> list:
+        # Naive scan over every payload, good enough for tests and small local caches
+        words = query.lower().split()
+        if not words:
+            return []
+
+        results = []
+        for key, value in self._cache.items():
+            try:
+                document = extract_search_document(json.loads(value))
+            except ValueError:
+                continue
+            if document is None:
+                continue
+
+            text = "\n".join(document.values()).lower()
+            if all(word in text for word in words):
+                results.append({"key": key, "title": escape(document["title"], quote=False), "snippet": "", "rank": -sum(text.count(word) for word in words)})
+
+        results.sort(key=lambda result: result["rank"])
+        return results[offset:offset + limit]
+
+    def rebuild_search_index(self) -> int:
+        return len(self._cache)
+
+    def pull_rendered(self, key: str) -> RenderedCacheResponse:
+        if key in self._rendered:
+            _, value, compressed = self._rendered[key]
+            return RenderedCacheResponse(value, dict(compressed))
+
+    def push_rendered(self, key: str, post_id: str, value: Union[dict, str], compressed: dict = None) -> None:
+        self._rendered[key] = (post_id, serialize_value(value), dict(compressed or {}))
+
+    def delete_rendered(self, post_id: str) -> None:
+        for key in [key for key, rendered in self._rendered.items() if rendered[0] == post_id]:
+            del self._rendered[key]
+
+    def delete_rendered_many(self, post_ids: list) -> None:
+        post_ids = set(post_ids)
+        for key in [key for key, rendered in self._rendered.items() if rendered[0] in post_ids]:
+            del self._rendered[key]
+
+    def iter_rendered(self, page_size: int = 500) -> Iterator[tuple]:
+        yield from [(key, post_id, value, dict(compressed)) for key, (post_id, value, compressed) in self._rendered.items()]
+
+    def pull_media_resource(self, key: str) -> CacheResponse:
+        if key in self._media_resources:
+            return CacheResponse(self._media_resources[key][1])
+
+    def push_media_resources(self, post_id: str, items: list) -> None:
+        for key, value in items:
+            self._media_resources[key] = (post_id, serialize_value(value))
+
+    def delete_media_resources(self, post_id: str) -> None:
+        for key in [key for key, media_resource in self._media_resources.items() if media_resource[0] == post_id]:
+            del self._media_resources[key]
+
+    def pull_negative(self, key: str) -> Optional[str]:
+        if key in self._negative:
+            reason, expires_at = self._negative[key]
+            if expires_at > time.time():
+                return reason
+            del self._negative[key]
+
+    def push_negative(self, key: str, reason: str, ttl: float) -> None:
+        self._negative[key] = (reason, time.time() + ttl)
+
+    def delete_negative(self, key: str) -> None:
+        self._negative.pop(key, None)
+
+    def pull_refresh_schedule(self, keys: list) -> dict:
+        return {key: self._refresh_schedule[key] for key in keys if key in self._refresh_schedule}
+
+    def push_refresh_schedule(self, rows: list) -> None:
+        for key, *schedule in rows:
+            self._refresh_schedule[key] = tuple(schedule)
+
+    def add_refresh_hits(self, hits: dict) -> None:
+        for key, key_hits in hits.items():
+            if key in self._refresh_schedule:
+                old_hits, *schedule = self._refresh_schedule[key]
+                self._refresh_schedule[key] = (old_hits + key_hits, *schedule)
+
+    def due_refreshes(self, now: float, limit: int) -> list:
+        due = sorted((schedule[3], key) for key, schedule in self._refresh_schedule.items() if schedule[3] <= now)
+        return [key for _, key in due[:limit]]
+
+    def claim_refreshes(self, schedule: dict, lease_until: float) -> list:
+        claimed = []
+        for key, next_refresh_at in schedule.items():
+            if key in self._refresh_schedule and self._refresh_schedule[key][3] == next_refresh_at:
+                self._refresh_schedule[key] = (*self._refresh_schedule[key][:3], lease_until)
+                claimed.append(key)
+        return claimed
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Cache in SQLite database. With `full_text_search` enabled, posts are indexed in FTS5 `posts_fts` table on push,
+    so they can be found with `search`. Index is only written by push and delete, `pull` doesn't touch it. Index
+    isn't updated while database is opened without `full_text_search`, call `rebuild_search_index` after that.
+    """
+    __slots__ = ('connection', 'cursor', 'full_text_search', '_fts')
+    def __init__(self, database: str, full_text_search: bool = False):
         self.connection = sqlite3.connect(database)
-        self.connection.enable_load_extension(True)  # Enable loading of extensions
         self.connection.execute("PRAGMA foreign_keys = ON")  # Need for working with foreign keys in db
         self.connection.execute("PRAGMA journal_mode=WAL")
         self.connection.execute("PRAGMA auto_vacuum=full")
         self.cursor = self.connection.cursor()
 
+        sqlite_zstd = load_sqlite_zstd()
         if sqlite_zstd is not None:
+            self.connection.enable_load_extension(True)  # Enable loading of extensions
             sqlite_zstd.load(self.connection)
 
+        self.full_text_search = full_text_search
+        self._fts = full_text_search and self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'").fetchone() is not None
+
     def all(self):
         with self.connection:
             return self.cursor.execute("SELECT * FROM cache").fetchall()
@@ -44,11 +465,116 @@ class SQLiteCacheBackend:
             return self.cursor.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
 
     def random(self, size: int):
+        """
+        Sample up to `size` distinct rows uniformly. Large tables are sampled by probing random rowids, O(size * log(n))
+        instead of sorting whole table. Probes only accept exact rowid hits, so rows next to rowid gaps (deleted rows)
+        aren't favoured. Small tables, and tables too sparse for probes to find enough rows, are sorted randomly.
+
+        Keys are sampled from the table which stores rows (`_cache_zstd` with zstd enabled, since `cache` is a view
+        then), and only values of sampled keys are read, so values of other rows are never decompressed.
+        """
+        with self.connection:
+            table = "_cache_zstd" if self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = '_cache_zstd'").fetchone() else "cache"
+            random_order_query = f"SELECT key FROM {table} ORDER BY RANDOM() LIMIT :0"
+
+            min_rowid, max_rowid = self.cursor.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}").fetchone()
+            if min_rowid is None:
+                return []
+
+            # Rowid span is an upper bound of rows count
+            if max_rowid - min_rowid + 1 <= max(size * RANDOM_PROBES_PER_ROW, RANDOM_ORDER_MAX_ROWS):
+                keys = [row[0] for row in self.cursor.execute(random_order_query, {'0': size})]
+            else:
+                sample = {}
+                for _ in range(size * RANDOM_PROBES_PER_ROW):
+                    if len(sample) >= size:
+                        break
+                    rowid = random.randint(min_rowid, max_rowid)
+                    row = self.cursor.execute(f"SELECT key FROM {table} WHERE rowid = :0", {'0': rowid}).fetchone()
+                    if row:
+                        sample[rowid] = row[0]
+
+                if len(sample) < size:
+                    logger.debug(f"Only {len(sample)} of {size} rowid probes hit, cache table is sparse, sampling with random order")
+                    keys = [row[0] for row in self.cursor.execute(random_order_query, {'0': size})]
+                else:
+                    keys = list(sample.values())
+
+            rows = []
+            for i in range(0, len(keys), RANDOM_FETCH_BATCH):
+                batch = keys[i:i + RANDOM_FETCH_BATCH]
+                rows.extend(self.cursor.execute(f"SELECT key, value FROM cache WHERE key IN ({', '.join('?' * len(batch))})", batch).fetchall())
+
+        # IN doesn't keep order of keys, shuffle so order is random too
+        random.shuffle(rows)
+        return rows
+
+    def iter_items(self, page_size: int = 500, since: float = None) -> Iterator[tuple]:
+        # Keyset pagination over primary key, so every page is an index range scan
+        if since is None:
+            query = "SELECT key, value FROM cache WHERE key > :0 ORDER BY key LIMIT :1"
+        else:
+            # Rows cached before `cache_meta` was introduced have no push time, run `backfill_meta` to include them
+            query = "SELECT key, value FROM cache JOIN cache_meta USING (key) WHERE key > :0 AND pushed_at >= :2 ORDER BY key LIMIT :1"
+
+        last_key = ""
+        while True:
+            with self.connection:
+                rows = self.cursor.execute(query, {'0': last_key, '1': page_size, '2': since}).fetchall()
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_key = rows[-1][0]
+
+    def iter_keys(self, page_size: int = 5000) -> Iterator[str]:
+        last_key = ""
+        while True:
+            with self.connection:
+                rows = self.cursor.execute("SELECT key FROM cache WHERE key > :0 ORDER BY key LIMIT :1", {'0': last_key, '1': page_size}).fetchall()
+            for row in rows:
+                yield row[0]
+            if len(rows) < page_size:
+                return
+            last_key = rows[-1][0]
+
+    def stats(self, measure_disk: bool = False) -> dict:
+        with self.connection:
+            rows = self.cursor.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            tracked_rows, total_bytes = self.cursor.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_meta").fetchone()
+            disk_bytes = None
+            if measure_disk:
+                # dbstat reads every page of the table, O(table size) I/O
+                disk_bytes = self._disk_bytes()
+
+        return {
+            "rows": rows,
+            "untracked_rows": max(rows - tracked_rows, 0),
+            "total_bytes": total_bytes,
+            "disk_bytes": disk_bytes,
+            "compression_ratio": total_bytes / disk_bytes if disk_bytes else None,
+        }
+
+    def _disk_bytes(self) -> Optional[int]:
+        try:
+            # Pages of cache table only, not rendered output or indexes. With zstd enabled, `cache` is a view
+            # over `_cache_zstd`
+            return self.cursor.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN ('cache', '_cache_zstd')").fetchone()[0]
+        except sqlite3.OperationalError:
+            # SQLite built without SQLITE_ENABLE_DBSTAT_VTAB
+            return None
+
+    def backfill_meta(self) -> None:
+        """
+        Track sizes of rows cached before `cache_meta` table was introduced. Reads every value once.
+        """
         with self.connection:
-            return self.cursor.execute("SELECT * FROM cache ORDER BY RANDOM() LIMIT :0", {'0': size}).fetchall()
+            self.cursor.execute(
+                "INSERT OR IGNORE INTO cache_meta SELECT key, LENGTH(CAST(value AS BLOB)), :0 FROM cache WHERE key NOT IN (SELECT key FROM cache_meta)",
+                {'0': time.time()},
+            )
 
     def enable_zstd(self):
-        if sqlite_zstd is None:
+        if load_sqlite_zstd() is None:
             raise ValueError("Can't use zstd compression. Please install 'sqlite_zstd' package")
         
         with self.connection:
@@ -63,6 +589,31 @@ class SQLiteCacheBackend:
     def init_db(self):
         with self.connection:
             self.cursor.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT)")
+            # Size and push time of cached values, so stats don't need to read values
+            self.cursor.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, size INTEGER, pushed_at REAL)")
+            self.cursor.execute("CREATE TABLE IF NOT EXISTS rendered (key TEXT PRIMARY KEY, post_id TEXT, value TEXT, gzip BLOB, br BLOB)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS rendered_post_id ON rendered (post_id)")
+            # Iframe media resources, keyed by their own ID since iframes are served by it, but owned by embedding post
+            self.cursor.execute("CREATE TABLE IF NOT EXISTS media_resource (key TEXT PRIMARY KEY, post_id TEXT, value TEXT)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS media_resource_post_id ON media_resource (post_id)")
+            # Posts which can't be queried from API, kept apart from payloads since they expire
+            self.cursor.execute("CREATE TABLE IF NOT EXISTS negative_cache (key TEXT PRIMARY KEY, reason TEXT, expires_at REAL)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS negative_cache_expires_at ON negative_cache (expires_at)")
+            self.cursor.execute("CREATE TABLE IF NOT EXISTS refresh_schedule (key TEXT PRIMARY KEY, hits INTEGER, post_updated_at REAL, refreshed_at REAL, next_refresh_at REAL)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS refresh_schedule_next_refresh_at ON refresh_schedule (next_refresh_at)")
+
+        if self.full_text_search and not self._fts:
+            try:
+                with self.connection:
+                    # Rowid of a row is `search_rowid` of its key, key column itself isn't searchable
+                    self.cursor.execute(
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5("
+                        "key UNINDEXED, title, subtitle, creator, collection, tags, body, tokenize='unicode61 remove_diacritics 2')"
+                    )
+            except sqlite3.OperationalError as error:
+                warn(f"Can't create full-text search index, SQLite is probably built without FTS5: {error}")
+            else:
+                self._fts = True
 
     def pull(self, key: str) -> Union[dict, str]:
         with self.connection:
@@ -71,16 +622,270 @@ class SQLiteCacheBackend:
                 return CacheResponse(cache[0])
 
     def push(self, key: str, value: str) -> None:
-        if isinstance(value, dict):
-            value = json.dumps(value)
-        elif not isinstance(value, str):
-            raise ValueError(f"value argument should be only string type not {type(value).__name__}")
         with self.connection:
-            self.cursor.execute("INSERT OR REPLACE INTO cache VALUES (:0, :1)", {'0': key, '1': value})
+            self._push(key, value)
+            self._index_search([(key, value)])
+
+    def _push(self, key: str, document: Union[dict, str]) -> None:
+        now = time.time()
+        value = serialize_value(document)
+        self.cursor.execute("INSERT OR REPLACE INTO cache VALUES (:0, :1)", {'0': key, '1': value})
+        self.cursor.execute("INSERT OR REPLACE INTO cache_meta VALUES (:0, :1, :2)", {'0': key, '1': len(value.encode("utf-8")), '2': now})
+        self.cursor.execute(SCHEDULE_PUSHED_QUERY, first_refresh(key, document, now))
+
+    def replace_post(self, key: str, value: Union[dict, str]) -> None:
+        document = value
+        with self.connection:
+            self._push(key, value)
+            self.cursor.execute("DELETE FROM rendered WHERE post_id = :0", {'0': key})
+            self._index_search([(key, document)])
+
+    def push_many(self, items: list) -> None:
+        # Single transaction for the whole batch
+        with self.connection:
+            self._push_many(items)
+
+    def replace_posts(self, items: list, rendered_rows: list = ()) -> None:
+        with self.connection:
+            self._push_many(items)
+            self._delete_rendered_many([key for key, _ in items])
+            self._push_rendered_many(rendered_rows)
+
+    def _push_many(self, items: list) -> None:
+        documents = items
+        items = [(key, serialize_value(value)) for key, value in items]
+        now = time.time()
+        self.cursor.executemany("INSERT OR REPLACE INTO cache VALUES (:0, :1)", ({'0': key, '1': value} for key, value in items))
+        self.cursor.executemany("INSERT OR REPLACE INTO cache_meta VALUES (:0, :1, :2)", ({'0': key, '1': len(value.encode("utf-8")), '2': now} for key, value in items))
+        self.cursor.executemany(SCHEDULE_PUSHED_QUERY, (first_refresh(key, document, now) for key, document in documents))
+        self._index_search(documents)
+
+    def _index_search(self, items: list) -> None:
+        """
+        Replace index rows of (key, value) items, must be called inside a transaction. Values which aren't posts
+        are only dropped from index.
+        """
+        if not self._fts:
+            return
+
+        rows = []
+        for key, value in items:
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    value = None
+            document = extract_search_document(value)
+            if document is not None:
+                rows.append({"rowid": search_rowid(key), "key": key, **document})
+
+        self.cursor.executemany("DELETE FROM posts_fts WHERE rowid = ?", ((search_rowid(key),) for key, _ in items))
+        self.cursor.executemany(
+            "INSERT INTO posts_fts (rowid, key, title, subtitle, creator, collection, tags, body) "
+            "VALUES (:rowid, :key, :title, :subtitle, :creator, :collection, :tags, :body)",
+            rows,
+        )
 
     def delete(self, key: str) -> None:
         with self.connection:
             self.cursor.execute("DELETE FROM cache WHERE key = :0", {'0': key})
+            self.cursor.execute("DELETE FROM cache_meta WHERE key = :0", {'0': key})
+            self.cursor.execute("DELETE FROM refresh_schedule WHERE key = :0", {'0': key})
+            if self._fts:
+                self.cursor.execute("DELETE FROM posts_fts WHERE rowid = :0", {'0': search_rowid(key)})
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, raw: bool = False) -> list:
+        if not self._fts:
+            raise ValueError("Full-text search index isn't available, enable full_text_search and call init_db")
+
+        if not raw:
+            query = quote_search_query(query)
+        if not query:
+            return []
+
+        with self.connection:
+            # Column weights of bm25: matches in title count the most, then subtitle and tags
+            rows = self.cursor.execute(
+                "SELECT key, title, snippet(posts_fts, -1, :open, :close, '…', 16), bm25(posts_fts, 0, 10.0, 5.0, 2.0, 2.0, 3.0, 1.0) AS rank "
+                "FROM posts_fts WHERE posts_fts MATCH :query ORDER BY rank LIMIT :limit OFFSET :offset",
+                {'open': SNIPPET_OPEN, 'close': SNIPPET_CLOSE, 'query': query, 'limit': limit, 'offset': offset},
+            ).fetchall()
+
+        return [{"key": key, "title": escape(title, quote=False), "snippet": highlight_snippet(snippet), "rank": rank} for key, title, snippet, rank in rows]
+
+    def rebuild_search_index(self, page_size: int = 500) -> int:
+        """
+        Index every cached post from scratch, e.g. posts cached before index was introduced. Reads every value once.
+        """
+        if not self._fts:
+            raise ValueError("Full-text search index isn't available, enable full_text_search and call init_db")
+
+        with self.connection:
+            self.cursor.execute("DELETE FROM posts_fts")
+
+        indexed = 0
+        page = []
+        for row in self.iter_items(page_size):
+            page.append(row)
+            if len(page) >= page_size:
+                with self.connection:
+                    self._index_search(page)
+                indexed += len(page)
+                page = []
+
+        with self.connection:
+            self._index_search(page)
+            # Merge index b-trees built by many small inserts
+            self.cursor.execute("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')")
+        indexed += len(page)
+
+        logger.info(f"Rebuilt full-text search index over {indexed} cached payloads")
+        return indexed
+
+    def pull_rendered(self, key: str) -> RenderedCacheResponse:
+        with self.connection:
+            cache = self.cursor.execute("SELECT value, gzip, br FROM rendered WHERE key = :0", {'0': key}).fetchone()
+            if cache:
+                compressed = {encoding: data for encoding, data in (("gzip", cache[1]), ("br", cache[2])) if data is not None}
+                return RenderedCacheResponse(cache[0], compressed)
+
+    def push_rendered(self, key: str, post_id: str, value: str, compressed: dict = None) -> None:
+        value = serialize_value(value)
+        compressed = compressed or {}
+        with self.connection:
+            self.cursor.execute(
+                "INSERT OR REPLACE INTO rendered VALUES (:0, :1, :2, :3, :4)",
+                {'0': key, '1': post_id, '2': value, '3': compressed.get("gzip"), '4': compressed.get("br")},
+            )
+
+    def delete_rendered(self, post_id: str) -> None:
+        with self.connection:
+            self.cursor.execute("DELETE FROM rendered WHERE post_id = :0", {'0': post_id})
+
+    def delete_rendered_many(self, post_ids: list) -> None:
+        with self.connection:
+            self._delete_rendered_many(post_ids)
+
+    def _delete_rendered_many(self, post_ids: list) -> None:
+        # Staged in a temporary table, so any number of posts is deleted by a single statement
+        self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS staged_post_ids (post_id TEXT PRIMARY KEY)")
+        self.cursor.execute("DELETE FROM staged_post_ids")
+        self.cursor.executemany("INSERT OR IGNORE INTO staged_post_ids VALUES (?)", ((post_id,) for post_id in post_ids))
+        self.cursor.execute("DELETE FROM rendered WHERE post_id IN (SELECT post_id FROM staged_post_ids)")
+
+    def push_rendered_many(self, rows: list) -> None:
+        with self.connection:
+            self._push_rendered_many(rows)
+
+    def _push_rendered_many(self, rows: list) -> None:
+        self.cursor.executemany(
+            "INSERT OR REPLACE INTO rendered VALUES (?, ?, ?, ?, ?)",
+            ((key, post_id, serialize_value(value), (compressed or {}).get("gzip"), (compressed or {}).get("br")) for key, post_id, value, compressed in rows),
+        )
+
+    def iter_rendered(self, page_size: int = 500) -> Iterator[tuple]:
+        last_key = ""
+        while True:
+            with self.connection:
+                rows = self.cursor.execute("SELECT key, post_id, value, gzip, br FROM rendered WHERE key > :0 ORDER BY key LIMIT :1", {'0': last_key, '1': page_size}).fetchall()
+            for key, post_id, value, gzip, br in rows:
+                yield key, post_id, value, {encoding: data for encoding, data in (("gzip", gzip), ("br", br)) if data is not None}
+            if len(rows) < page_size:
+                return
+            last_key = rows[-1][0]
+
+    def pull_media_resource(self, key: str) -> CacheResponse:
+        with self.connection:
+            cache = self.cursor.execute("SELECT value FROM media_resource WHERE key = :0", {'0': key}).fetchone()
+            if cache:
+                return CacheResponse(cache[0])
+
+    def push_media_resources(self, post_id: str, items: list) -> None:
+        with self.connection:
+            self.cursor.executemany("INSERT OR REPLACE INTO media_resource VALUES (?, ?, ?)", ((key, post_id, serialize_value(value)) for key, value in items))
+
+    def delete_media_resources(self, post_id: str) -> None:
+        with self.connection:
+            self.cursor.execute("DELETE FROM media_resource WHERE post_id = :0", {'0': post_id})
+
+    @contextmanager
+    def bulk_load(self, defer_indexes: bool = True):
+        """
+        Commits don't wait for fsync while loading. With `defer_indexes`, secondary index of rendered output is
+        dropped, pushed posts aren't indexed for full-text search one by one, and both indexes are rebuilt from the
+        whole cache at exit instead, which is faster when most of the cache is loaded.
+        """
+        fts = self._fts
+        synchronous = self.cursor.execute("PRAGMA synchronous").fetchone()[0]
+        self.cursor.execute("PRAGMA synchronous=OFF")
+        if defer_indexes:
+            with self.connection:
+                self.cursor.execute("DROP INDEX IF EXISTS rendered_post_id")
+            self._fts = False
+
+        try:
+            yield self
+        finally:
+            self._fts = fts
+            self.cursor.execute(f"PRAGMA synchronous={int(synchronous)}")
+            with self.connection:
+                self.cursor.execute("CREATE INDEX IF NOT EXISTS rendered_post_id ON rendered (post_id)")
+            if defer_indexes and fts:
+                self.rebuild_search_index()
+
+    def pull_negative(self, key: str) -> Optional[str]:
+        with self.connection:
+            cache = self.cursor.execute("SELECT reason FROM negative_cache WHERE key = :0 AND expires_at > :1", {'0': key, '1': time.time()}).fetchone()
+            if cache:
+                return cache[0]
+
+    def push_negative(self, key: str, reason: str, ttl: float) -> None:
+        now = time.time()
+        with self.connection:
+            self.cursor.execute("DELETE FROM negative_cache WHERE expires_at <= :0", {'0': now})
+            self.cursor.execute("INSERT OR REPLACE INTO negative_cache VALUES (:0, :1, :2)", {'0': key, '1': reason, '2': now + ttl})
+
+    def delete_negative(self, key: str) -> None:
+        with self.connection:
+            self.cursor.execute("DELETE FROM negative_cache WHERE key = :0", {'0': key})
+
+    def pull_refresh_schedule(self, keys: list) -> dict:
+        schedule = {}
+        with self.connection:
+            # Stay under SQLite limit of bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.cursor.execute(
+                    f"SELECT key, hits, post_updated_at, refreshed_at, next_refresh_at FROM refresh_schedule WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                schedule.update((row[0], row[1:]) for row in rows)
+        return schedule
+
+    def push_refresh_schedule(self, rows: list) -> None:
+        with self.connection:
+            self.cursor.executemany("INSERT OR REPLACE INTO refresh_schedule VALUES (?, ?, ?, ?, ?)", rows)
+
+    def add_refresh_hits(self, hits: dict) -> None:
+        with self.connection:
+            self.cursor.executemany("UPDATE refresh_schedule SET hits = hits + ? WHERE key = ?", ((key_hits, key) for key, key_hits in hits.items()))
+
+    def due_refreshes(self, now: float, limit: int) -> list:
+        with self.connection:
+            rows = self.cursor.execute("SELECT key FROM refresh_schedule WHERE next_refresh_at <= :0 ORDER BY next_refresh_at LIMIT :1", {'0': now, '1': limit}).fetchall()
+        return [row[0] for row in rows]
+
+    def claim_refreshes(self, schedule: dict, lease_until: float) -> list:
+        claimed = []
+        with self.connection:
+            for key, next_refresh_at in schedule.items():
+                self.cursor.execute(
+                    "UPDATE refresh_schedule SET next_refresh_at = :0 WHERE key = :1 AND next_refresh_at = :2",
+                    {'0': lease_until, '1': key, '2': next_refresh_at},
+                )
+                if self.cursor.rowcount == 1:
+                    claimed.append(key)
+        return claimed
 
     def close(self):
         self.__del__()
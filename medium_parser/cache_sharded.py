@@ -0,0 +1,337 @@
+import asyncio
+import atexit
+import math
+import os
+import random
+import time
+import weakref
+import zlib
+from contextlib import ExitStack, contextmanager
+from typing import Iterator, Optional, Union
+
+from loguru import logger
+
+from .cache_db import CacheBackend, CacheResponse, RenderedCacheResponse, SQLiteCacheBackend, rendered_key_post_id, serialize_value
+
+
+class ShardedSQLiteCacheBackend(CacheBackend):
+    """
+    Cache spread over `shards` SQLite files, so concurrent writers of many worker processes contend on different locks.
+
+    Keys are routed by CRC32, which is stable across processes (unlike builtin `hash`). Given `database` path
+    "medium_db_cache.sqlite", shards are "medium_db_cache.0.sqlite", "medium_db_cache.1.sqlite" etc.
+
+    Pushed payloads are queued and written per shard in a single transaction, when `batch_size` payloads are queued
+    or `flush_interval` seconds passed since the oldest of them (timer on running event loop), and on `close` or
+    interpreter exit. So other processes see a pushed payload in at most `flush_interval` seconds, while `pull` of
+    the same process sees it right away. Pushes made outside of event loop are written through, since nothing could
+    flush them later. `batch_size=1` disables queueing.
+
+    `replace_post` is queued the same way. Rendered variants of a post queued for replacement are outdated, so they
+    aren't served, and variants rendered meanwhile from the fresh payload are queued too. Flush stores payloads,
+    drops outdated variants and stores new ones in a single transaction per shard.
+
+    `full_text_search` is passed to every shard, see `SQLiteCacheBackend`.
+    """
+    __slots__ = ('shards', 'batch_size', 'flush_interval', '_pending', '_pending_replaced', '_pending_rendered', '_pending_since', '_flush_handle', '_flush_at_exit', '__weakref__')
+
+    def __init__(self, database: str, shards: int = 8, batch_size: int = 64, flush_interval: float = 1.0, full_text_search: bool = False):
+        if shards < 1:
+            raise ValueError("shards argument should be at least 1")
+
+        root, ext = os.path.splitext(database)
+        self.shards = [SQLiteCacheBackend(f"{root}.{i}{ext}", full_text_search) for i in range(shards)]
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._pending_replaced = set()
+        self._pending_rendered = {}
+        self._pending_since = None
+        self._flush_handle = None
+
+        # Weak reference, so registered hook doesn't keep backend alive
+        backend = weakref.ref(self)
+        def flush_at_exit():
+            if backend() is not None:
+                backend().flush()
+        self._flush_at_exit = flush_at_exit
+        atexit.register(flush_at_exit)
+
+    def _shard(self, key: str) -> SQLiteCacheBackend:
+        return self.shards[zlib.crc32(key.encode("utf-8")) % len(self.shards)]
+
+    def init_db(self) -> None:
+        for shard in self.shards:
+            shard.init_db()
+
+    def all(self) -> list:
+        self.flush()
+        return [row for shard in self.shards for row in shard.all()]
+
+    def all_length(self) -> int:
+        self.flush()
+        return sum(shard.all_length() for shard in self.shards)
+
+    def random(self, size: int) -> list:
+        self.flush()
+        # Keys are spread evenly by hash, so shards are about the same size and can be sampled equally
+        rows = [row for shard in self.shards for row in shard.random(math.ceil(size / len(self.shards)) + 1)]
+        return random.sample(rows, min(size, len(rows)))
+
+    def iter_items(self, page_size: int = 500, since: float = None) -> Iterator[tuple]:
+        self.flush()
+        for shard in self.shards:
+            yield from shard.iter_items(page_size, since)
+
+    def iter_keys(self, page_size: int = 5000) -> Iterator[str]:
+        self.flush()
+        for shard in self.shards:
+            yield from shard.iter_keys(page_size)
+
+    def stats(self, measure_disk: bool = False) -> dict:
+        self.flush()
+        stats = {"rows": 0, "untracked_rows": 0, "total_bytes": 0, "disk_bytes": 0}
+        for shard in self.shards:
+            shard_stats = shard.stats(measure_disk)
+            for name in stats:
+                if stats[name] is None or shard_stats[name] is None:
+                    stats[name] = None
+                else:
+                    stats[name] += shard_stats[name]
+
+        stats["compression_ratio"] = stats["total_bytes"] / stats["disk_bytes"] if stats["disk_bytes"] else None
+        return stats
+
+    def pull(self, key: str) -> CacheResponse:
+        if key in self._pending:
+            return CacheResponse(self._pending[key])
+        return self._shard(key).pull(key)
+
+    def push(self, key: str, value: Union[dict, str]) -> None:
+        self._pending[key] = serialize_value(value)
+        self._queued()
+
+    def _queued(self) -> None:
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._pending_since >= self.flush_interval:
+            self.flush()
+        else:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is not None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+
+        self._flush_handle = loop.call_later(self.flush_interval, self._flush_on_timer)
+
+    def _flush_on_timer(self) -> None:
+        self._flush_handle = None
+        try:
+            self.flush()
+        except Exception as ex:
+            # Payloads stay queued, try again later
+            logger.warning(f"Can't flush cached payloads: {ex!r}")
+            self._schedule_flush()
+
+    def push_many(self, items: list) -> None:
+        for key, value in items:
+            self._pending[key] = serialize_value(value)
+        self.flush()
+
+    def delete(self, key: str) -> None:
+        self._pending.pop(key, None)
+        self._pending_replaced.discard(key)
+        self._pending_rendered.pop(key, None)
+        self._shard(key).delete(key)
+
+    def replace_post(self, key: str, value: Union[dict, str]) -> None:
+        self._pending[key] = serialize_value(value)
+        self._pending_replaced.add(key)
+        # Rendered from previous payload
+        self._pending_rendered.pop(key, None)
+        self._queued()
+
+    def replace_posts(self, items: list, rendered_rows: list = ()) -> None:
+        for key, value in items:
+            self._pending[key] = serialize_value(value)
+            self._pending_replaced.add(key)
+            self._pending_rendered.pop(key, None)
+        for row in rendered_rows:
+            self.push_rendered(*row)
+        self.flush()
+
+    # Rendered variants are routed by their post ID, so they live in the same shard as the post payload
+    def pull_rendered(self, key: str) -> RenderedCacheResponse:
+        post_id = rendered_key_post_id(key)
+        if post_id in self._pending_replaced:
+            row = self._pending_rendered.get(post_id, {}).get(key)
+            return RenderedCacheResponse(row[2], dict(row[3])) if row else None
+        return self._shard(post_id).pull_rendered(key)
+
+    def push_rendered(self, key: str, post_id: str, value: Union[dict, str], compressed: dict = None) -> None:
+        if post_id in self._pending_replaced:
+            # Written after the fresh payload by flush, otherwise flush would drop it as outdated
+            self._pending_rendered.setdefault(post_id, {})[key] = (key, post_id, serialize_value(value), compressed or {})
+            return
+        self._shard(post_id).push_rendered(key, post_id, value, compressed)
+
+    def delete_rendered(self, post_id: str) -> None:
+        self._pending_rendered.pop(post_id, None)
+        self._shard(post_id).delete_rendered(post_id)
+
+    def delete_rendered_many(self, post_ids: list) -> None:
+        post_ids_by_shard = {}
+        for post_id in post_ids:
+            self._pending_rendered.pop(post_id, None)
+            post_ids_by_shard.setdefault(self._shard(post_id), []).append(post_id)
+
+        for shard, shard_post_ids in post_ids_by_shard.items():
+            shard.delete_rendered_many(shard_post_ids)
+
+    def push_rendered_many(self, rows: list) -> None:
+        rows_by_shard = {}
+        for row in rows:
+            if row[1] in self._pending_replaced:
+                self.push_rendered(*row)
+                continue
+            rows_by_shard.setdefault(self._shard(row[1]), []).append(row)
+
+        for shard, shard_rows in rows_by_shard.items():
+            shard.push_rendered_many(shard_rows)
+
+    def iter_rendered(self, page_size: int = 500) -> Iterator[tuple]:
+        self.flush()
+        for shard in self.shards:
+            yield from shard.iter_rendered(page_size)
+
+    # Media resources are routed by their own ID, since iframes are served by it without knowing the post
+    def pull_media_resource(self, key: str) -> CacheResponse:
+        return self._shard(key).pull_media_resource(key)
+
+    def push_media_resources(self, post_id: str, items: list) -> None:
+        items_by_shard = {}
+        for key, value in items:
+            items_by_shard.setdefault(self._shard(key), []).append((key, value))
+
+        for shard, shard_items in items_by_shard.items():
+            shard.push_media_resources(post_id, shard_items)
+
+    def delete_media_resources(self, post_id: str) -> None:
+        for shard in self.shards:
+            shard.delete_media_resources(post_id)
+
+    @contextmanager
+    def bulk_load(self, defer_indexes: bool = True):
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.bulk_load(defer_indexes))
+            try:
+                yield self
+            finally:
+                self.flush()
+
+    def pull_negative(self, key: str) -> Optional[str]:
+        return self._shard(key).pull_negative(key)
+
+    def push_negative(self, key: str, reason: str, ttl: float) -> None:
+        self._shard(key).push_negative(key, reason, ttl)
+
+    def delete_negative(self, key: str) -> None:
+        self._shard(key).delete_negative(key)
+
+    def pull_refresh_schedule(self, keys: list) -> dict:
+        keys_by_shard = {}
+        for key in keys:
+            keys_by_shard.setdefault(self._shard(key), []).append(key)
+
+        schedule = {}
+        for shard, shard_keys in keys_by_shard.items():
+            schedule.update(shard.pull_refresh_schedule(shard_keys))
+        return schedule
+
+    def push_refresh_schedule(self, rows: list) -> None:
+        rows_by_shard = {}
+        for row in rows:
+            rows_by_shard.setdefault(self._shard(row[0]), []).append(row)
+
+        for shard, shard_rows in rows_by_shard.items():
+            shard.push_refresh_schedule(shard_rows)
+
+    def add_refresh_hits(self, hits: dict) -> None:
+        hits_by_shard = {}
+        for key, key_hits in hits.items():
+            hits_by_shard.setdefault(self._shard(key), {})[key] = key_hits
+
+        for shard, shard_hits in hits_by_shard.items():
+            shard.add_refresh_hits(shard_hits)
+
+    def claim_refreshes(self, schedule: dict, lease_until: float) -> list:
+        schedule_by_shard = {}
+        for key, next_refresh_at in schedule.items():
+            schedule_by_shard.setdefault(self._shard(key), {})[key] = next_refresh_at
+
+        return [key for shard, shard_schedule in schedule_by_shard.items() for key in shard.claim_refreshes(shard_schedule, lease_until)]
+
+    def due_refreshes(self, now: float, limit: int) -> list:
+        due = []
+        for shard in self.shards:
+            keys = shard.due_refreshes(now, limit)
+            schedule = shard.pull_refresh_schedule(keys)
+            due.extend((schedule[key][3], key) for key in keys if key in schedule)
+        return [key for _, key in sorted(due)[:limit]]
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, raw: bool = False) -> list:
+        self.flush()
+        # bm25 ranks of shards come from per-shard term statistics, close enough to compare since keys are spread evenly
+        results = [result for shard in self.shards for result in shard.search(query, limit + offset, 0, raw)]
+        results.sort(key=lambda result: result["rank"])
+        return results[offset:offset + limit]
+
+    def rebuild_search_index(self) -> int:
+        self.flush()
+        return sum(shard.rebuild_search_index() for shard in self.shards)
+
+    def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._pending:
+            return
+
+        flushed = len(self._pending)
+        batches = {}
+        for key, value in self._pending.items():
+            pushed, replaced, rendered_rows = batches.setdefault(self._shard(key), ([], [], []))
+            if key in self._pending_replaced:
+                replaced.append((key, value))
+                rendered_rows.extend(self._pending_rendered.get(key, {}).values())
+            else:
+                pushed.append((key, value))
+
+        for shard, (pushed, replaced, rendered_rows) in batches.items():
+            if pushed:
+                shard.push_many(pushed)
+            if replaced:
+                shard.replace_posts(replaced, rendered_rows)
+
+        self._pending = {}
+        self._pending_replaced = set()
+        self._pending_rendered = {}
+        self._pending_since = None
+
+        logger.trace(f"Flushed {flushed} cached payloads to {len(batches)} shards")
+
+    def close(self) -> None:
+        self.flush()
+        atexit.unregister(self._flush_at_exit)
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from typing import Union
+
+from loguru import logger
+
+from .time import LatencyTracker
+
+DEFAULT_DB_PATH = "medium_db_cache.sqlite"
+# Bounds memory of post hits counter between flushes
+MAX_TRACKED_POST_HITS = 100_000
+# Post hits are added to refresh schedule in cache at most this often, so every process contributes to popularity
+POST_HITS_FLUSH_INTERVAL = 30
+
+
+class MediumParserContext:
+    """
+    Configuration and shared resources of the parser: cache backend (any `CacheBackend`, sharded over
+    `cache_shards` SQLite files by default if more than one), auth cookies (pool of Medium accounts),
+    outbound request scheduler, retry options, API latency stats and Jinja environment.
+
+    Posts which Medium API refused to return (deleted, private or bogus IDs) are remembered for `negative_cache_ttl`
+    seconds, so they don't hit the API again. `negative_cache_ttl=0` disables it.
+
+    With `full_text_search` enabled, default cache backend indexes pushed posts for `cache.search`.
+
+    With `hedge_requests` enabled, GraphQL query fires a second attempt if the first one is slower than
+    `hedge_percentile` of recent API latencies, and keeps whichever response comes first.
+
+    With `prefetch_links` enabled, Medium posts linked from rendered posts are fetched into cache in background
+    by `link_prefetcher`. With `prefetch_media_resources` enabled, media resources of iframes embedded in a post are
+    fetched in background in one request once it's rendered, so serving iframes doesn't need a request per iframe.
+
+    Every resource is created on first use, so importing the package doesn't touch the filesystem, environment
+    or heavy dependencies, and it's safe to fork worker processes after import.
+    """
+    __slots__ = ('db_path', 'cache_shards', 'retry_attempts', 'hedge_requests', 'hedge_percentile', 'negative_cache_ttl', 'full_text_search', 'prefetch_links', 'prefetch_media_resources', 'negative_cache_hits', 'post_hits', '_post_hits_flushed_at', 'api_latency', '_auth_cookies', '_credential_pool', '_scheduler', '_link_prefetcher', '_background_tasks', '_cache', '_retry_options', '_jinja_env')
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, auth_cookies: Union[str, list] = None, cache_shards: int = 1, retry_attempts: int = 3, retry_options=None, cache=None, credential_pool=None, scheduler=None, hedge_requests: bool = False, hedge_percentile: float = 95, negative_cache_ttl: float = 300, full_text_search: bool = False, prefetch_links: bool = False, link_prefetcher=None, prefetch_media_resources: bool = False):
+        self.db_path = db_path
+        self.cache_shards = cache_shards
+        self.retry_attempts = retry_attempts
+        self.hedge_requests = hedge_requests
+        self.hedge_percentile = hedge_percentile
+        self.negative_cache_ttl = negative_cache_ttl
+        self.full_text_search = full_text_search
+        self.prefetch_links = prefetch_links
+        self.prefetch_media_resources = prefetch_media_resources
+        self.negative_cache_hits = 0
+        self.post_hits = Counter()
+        self._post_hits_flushed_at = time.monotonic()
+        self.api_latency = LatencyTracker()
+        self._auth_cookies = auth_cookies
+        self._credential_pool = credential_pool
+        self._scheduler = scheduler
+        self._link_prefetcher = link_prefetcher
+        self._background_tasks = set()
+        self._retry_options = retry_options
+        self._cache = cache
+        self._jinja_env = None
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            if self.cache_shards > 1:
+                from .cache_sharded import ShardedSQLiteCacheBackend
+
+                self._cache = ShardedSQLiteCacheBackend(self.db_path, self.cache_shards, full_text_search=self.full_text_search)
+            else:
+                from .cache_db import SQLiteCacheBackend
+
+                self._cache = SQLiteCacheBackend(self.db_path, self.full_text_search)
+        return self._cache
+
+    @property
+    def retry_options(self):
+        if self._retry_options is None:
+            from aiohttp_retry import ExponentialRetry
+
+            self._retry_options = ExponentialRetry(attempts=self.retry_attempts)
+        return self._retry_options
+
+    @property
+    def jinja_env(self):
+        if self._jinja_env is None:
+            import jinja2
+
+            self._jinja_env = jinja2.Environment(enable_async=True)
+        return self._jinja_env
+
+    @property
+    def auth_cookies(self) -> Union[str, list]:
+        if self._auth_cookies is None:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            self._auth_cookies = os.getenv("MEDIUM_AUTH_COOKIES")
+
+        if not self._auth_cookies:
+            raise ValueError("No auth cookies for Medium was found. Paywalled content doesn't will be available!!! Check MEDIUM_AUTH_COOKIES variable")
+
+        return self._auth_cookies
+
+    @property
+    def credential_pool(self):
+        if self._credential_pool is None:
+            from .credentials import CredentialPool
+
+            self._credential_pool = CredentialPool.from_config(self.auth_cookies)
+        return self._credential_pool
+
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            from .scheduler import OutboundScheduler
+
+            self._scheduler = OutboundScheduler()
+        return self._scheduler
+
+    @property
+    def link_prefetcher(self):
+        if self._link_prefetcher is None:
+            from .prefetch import LinkPrefetcher
+
+            self._link_prefetcher = LinkPrefetcher(self)
+        return self._link_prefetcher
+
+    def start_background(self, coroutine, description: str) -> asyncio.Future:
+        """
+        Run coroutine in background, keeping a reference to it until it's done. Failures are logged, not raised.
+        Must be called from a running event loop.
+        """
+        task = asyncio.ensure_future(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(lambda task: self._background_task_done(task, description))
+        return task
+
+    def _background_task_done(self, task: asyncio.Future, description: str) -> None:
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Can't {description}: {task.exception()!r}")
+
+    def is_known_unqueryable(self, post_id: str) -> bool:
+        if not self.negative_cache_ttl:
+            return False
+
+        reason = self.cache.pull_negative(post_id)
+        if reason is None:
+            return False
+
+        logger.debug(f"post {post_id} was found on negative cache: {reason}")
+        self.negative_cache_hits += 1
+        return True
+
+    def remember_unqueryable(self, post_id: str, post_data: dict) -> None:
+        """
+        Remember for a while that API did respond, but post is deleted, private or doesn't exist.
+        """
+        if not self.negative_cache_ttl:
+            return
+
+        reason = json.dumps(post_data.get("error")) if post_data.get("error") else "no post in response"
+        self.cache.push_negative(post_id, reason, self.negative_cache_ttl)
+
+    def record_post_access(self, post_id: str) -> None:
+        # Counted in memory and added to refresh schedule in batches, to weight refresh schedule by popularity
+        if post_id in self.post_hits or len(self.post_hits) < MAX_TRACKED_POST_HITS:
+            self.post_hits[post_id] += 1
+
+        if time.monotonic() - self._post_hits_flushed_at >= POST_HITS_FLUSH_INTERVAL:
+            self.flush_post_hits()
+
+    def drain_post_hits(self) -> Counter:
+        post_hits, self.post_hits = self.post_hits, Counter()
+        return post_hits
+
+    def flush_post_hits(self) -> int:
+        self._post_hits_flushed_at = time.monotonic()
+        post_hits = self.drain_post_hits()
+        if post_hits:
+            self.cache.add_refresh_hits(post_hits)
+        return len(post_hits)
+
+    def metrics(self) -> dict:
+        metrics = {
+            "negative_cache_hits": self.negative_cache_hits,
+            "api_latency_p95": self.api_latency.percentile(95),
+        }
+        if self._credential_pool is not None:
+            metrics["credentials"] = self._credential_pool.metrics()
+        if self._scheduler is not None:
+            metrics["scheduler"] = self._scheduler.metrics()
+        if self._link_prefetcher is not None:
+            metrics["link_prefetch"] = self._link_prefetcher.metrics()
+        return metrics
+
+    def close(self) -> None:
+        if self._link_prefetcher is not None:
+            self._link_prefetcher.cancel()
+        for task in list(self._background_tasks):
+            task.cancel()
+        if self._cache is not None:
+            self.flush_post_hits()
+            self._cache.close()
+            self._cache = None
+
+
+_default_context = None
+
+
+def get_context() -> MediumParserContext:
+    global _default_context
+    if _default_context is None:
+        _default_context = MediumParserContext()
+    return _default_context
+
+
+def set_context(context: MediumParserContext) -> MediumParserContext:
+    global _default_context
+    _default_context = context
+    return context
+
+
+def configure(**kwargs) -> MediumParserContext:
+    """
+    Replace default context with a new one, e.g. `configure(db_path="/var/lib/freedium/cache.sqlite", auth_cookies="...")`
+    """
+    if _default_context is not None:
+        _default_context.close()
+    return set_context(MediumParserContext(**kwargs))
@@ -1,53 +1,103 @@
+import asyncio
 import math
 import urllib.parse
-import tld
 import textwrap
+from typing import Optional, Union
 
-import jinja2
 from loguru import logger
 
-from . import jinja_env, cache
+from .cache_db import rendered_key
+from .context import MediumParserContext, get_context
 from .exceptions import (
+    DeadlineExceeded,
     InvalidMediumPostID,
     InvalidMediumPostURL,
     InvalidURL,
     MediumParserException,
     MediumPostQueryError,
 )
+from .media_resources import cache_media_resources
 from .medium_api import query_post_by_id
 from .models.html_result import HtmlResult
-from .time import convert_datetime_to_human_readable
-from .toolkits.rl_string_helper.rl_string_helper import RLStringHelper, parse_markups, split_overlapping_ranges
+from .prefetch import extract_linked_post_ids
+from .scheduler import Priority
+from .time import Deadline, cap_timeout, convert_datetime_to_human_readable
+from .toolkits.markup import HIGHLIGHT_MARKUP_TYPE, escape_html, render_markup_text
 from .utils import (
     get_medium_post_id_by_url,
     getting_percontage_of_match,
     is_valid_medium_post_id_hexadecimal,
     is_valid_medium_url,
     is_valid_url,
+    parse_medium_post_id_locally,
     sanitize_url,
 )
 
 
+def _retrieve_exception(task: asyncio.Future) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
 class MediumParser:
-    __slots__ = ('__post_id', 'post_data', 'jinja', 'timeout', 'host_address')
+    __slots__ = ('__post_id', 'post_data', 'jinja', 'timeout', 'host_address', 'context', 'deadline', '_prefetch')
 
-    def __init__(self, post_id: str, timeout: int, host_address: str):
+    def __init__(self, post_id: str, timeout: int, host_address: str, context: MediumParserContext = None, deadline: Union[Deadline, float] = None):
         self.timeout = timeout
         self.host_address = host_address
+        self.context = context or get_context()
+        self.deadline = Deadline.coerce(deadline)
         self.post_id = post_id
         self.post_data = None
+        self._prefetch = None
 
     @classmethod
-    async def from_url(cls, url: str, timeout: int, host_address: str) -> 'MediumParser':
+    async def from_url(cls, url: str, timeout: int, host_address: str, context: MediumParserContext = None, deadline: Union[Deadline, float] = None, priority: Priority = Priority.INTERACTIVE, speculative: bool = False) -> 'MediumParser':
+        """
+        `deadline` (Deadline or seconds from now) bounds URL validation, post ID resolving and following `query` call.
+
+        With `speculative` enabled, if post ID can be parsed from URL itself, post is queried concurrently with URL
+        validation (which may be a full page GET for custom domains), within the same `deadline` and `priority`.
+        Speculative query is cancelled if validation fails or resolves another post ID, otherwise its result is picked
+        up by the next `query` call, which waits for it no longer than its own deadline.
+        """
+        context = context or get_context()
+        deadline = Deadline.coerce(deadline)
         sanitized_url = sanitize_url(url)
-        if is_valid_url(url) and not await is_valid_medium_url(sanitized_url, timeout):
-            raise InvalidURL(f'Invalid medium URL: {sanitized_url}')
 
-        post_id = await get_medium_post_id_by_url(sanitized_url, timeout)
-        if not post_id:
-            raise InvalidMediumPostURL(f'Could not find medium post ID for URL: {sanitized_url}')
+        speculative_parser = None
+        if speculative:
+            speculative_post_id = parse_medium_post_id_locally(sanitized_url)
+            if speculative_post_id:
+                speculative_parser = cls(speculative_post_id, timeout, host_address, context, deadline)
+                speculative_parser._prefetch = asyncio.ensure_future(speculative_parser._query(True, deadline, priority))
+                # Failure is raised by `query` if it's picked up, otherwise nobody would retrieve it
+                speculative_parser._prefetch.add_done_callback(_retrieve_exception)
 
-        return cls(post_id, timeout, host_address)
+        try:
+            if is_valid_url(url) and not await is_valid_medium_url(sanitized_url, cap_timeout(timeout, deadline), context, priority):
+                raise InvalidURL(f'Invalid medium URL: {sanitized_url}')
+
+            post_id = await get_medium_post_id_by_url(sanitized_url, cap_timeout(timeout, deadline), context, priority)
+            if not post_id:
+                raise InvalidMediumPostURL(f'Could not find medium post ID for URL: {sanitized_url}')
+        except BaseException:
+            if speculative_parser is not None:
+                speculative_parser.cancel_prefetch()
+            raise
+
+        if speculative_parser is not None:
+            if speculative_parser.post_id == post_id:
+                return speculative_parser
+            logger.warning(f"Speculative post ID {speculative_parser.post_id} doesn't match resolved {post_id}")
+            speculative_parser.cancel_prefetch()
+
+        return cls(post_id, timeout, host_address, context, deadline)
+
+    def cancel_prefetch(self) -> None:
+        if self._prefetch is not None:
+            self._prefetch.cancel()
+            self._prefetch = None
 
     @property
     def post_id(self):
@@ -68,58 +118,94 @@ class MediumParser:
         if not post_id:
             post_id = self.post_id
 
-        cache.delete(post_id)
+        self.context.cache.delete(post_id)
+        self.context.cache.delete_rendered(post_id)
+        self.context.cache.delete_media_resources(post_id)
 
         return True
 
     async def get_post_data_from_cache(self):
         logger.debug("Using cache backend")
-        post_data = cache.pull(self.post_id)
+        post_data = self.context.cache.pull(self.post_id)
         if post_data:
             logger.debug("post query was found on cache")
             return post_data.json()
         return None
 
-    async def get_post_data_from_api(self):
+    async def get_post_data_from_api(self, deadline: Deadline = None, priority: Priority = Priority.INTERACTIVE):
         logger.debug("Cache backend disabled, using API")
         try:
-            return await query_post_by_id(self.post_id, self.timeout)
+            return await query_post_by_id(self.post_id, self.timeout, self.context, deadline, priority)
+        except DeadlineExceeded:
+            raise
         except Exception as ex:
             logger.debug("Error while querying post by Medium API")
             logger.exception(ex)
             return None
 
-    async def query(self, use_cache: bool = True):
+    def is_known_unqueryable(self) -> bool:
+        return self.context.is_known_unqueryable(self.post_id)
+
+    async def query(self, use_cache: bool = True, deadline: Union[Deadline, float] = None, priority: Priority = Priority.INTERACTIVE):
+        if self._prefetch is not None:
+            prefetch, self._prefetch = self._prefetch, None
+            if use_cache:
+                return await self._wait_prefetch(prefetch, Deadline.coerce(deadline))
+            prefetch.cancel()
+
+        return await self._query(use_cache, deadline, priority)
+
+    @staticmethod
+    async def _wait_prefetch(prefetch: asyncio.Future, deadline: Optional[Deadline]):
+        if deadline is None:
+            return await prefetch
+
+        try:
+            # Cancels speculative query if it doesn't make it in time
+            return await asyncio.wait_for(prefetch, deadline.remaining())
+        except asyncio.TimeoutError:
+            if deadline.expired:
+                raise DeadlineExceeded("Deadline exceeded while waiting for speculative query") from None
+            raise
+
+    async def _query(self, use_cache: bool, deadline: Union[Deadline, float], priority: Priority):
+        deadline = Deadline.coerce(deadline) or self.deadline
         post_data = await self.get_post_data_from_cache() if use_cache else None
 
-        if not post_data:
-            post_data = await self.get_post_data_from_api()
+        if post_data:
+            self.context.record_post_access(self.post_id)
+            self.post_data = post_data
+            return self.post_data
+
+        if use_cache and self.is_known_unqueryable():
+            raise MediumPostQueryError(f'Post is known to be not queryable, skip API query: {self.post_id}')
+
+        post_data = await self.get_post_data_from_api(deadline, priority)
+
+        if not post_data or not isinstance(post_data, dict):
+            raise MediumPostQueryError(f'Could not query post by ID from API: {self.post_id}')
 
-        if not post_data or not isinstance(post_data, dict) or post_data.get("error") or not post_data.get("data") or not post_data.get("data").get("post"):
+        if post_data.get("error") or not post_data.get("data") or not post_data.get("data").get("post"):
+            self.context.remember_unqueryable(self.post_id, post_data)
             raise MediumPostQueryError(f'Could not query post by ID from API: {self.post_id}')
 
-        cache.push(self.post_id, post_data)
+        # Fresh post data, so previously rendered output may be outdated
+        self.context.cache.replace_post(self.post_id, post_data)
+        self.context.record_post_access(self.post_id)
+        if self.context.negative_cache_ttl:
+            self.context.cache.delete_negative(self.post_id)
 
         self.post_data = post_data
         return self.post_data
 
     async def _parse_and_render_content_html_post(self, content: dict, title: str, subtitle: str, preview_image_id: str, highlights: list, tags: list) -> tuple[list, str, str]:
+        jinja_env = self.context.jinja_env
         paragraphs = content["bodyModel"]["paragraphs"]
         tags_list = [tag["displayTitle"] for tag in tags]
         out_paragraphs = []
+        media_resource_ids = []
         current_pos = 0
 
-        def parse_paragraph_text(text: str, markups: list) -> str:
-            text_formater = RLStringHelper(text)
-
-            parsed_markups = parse_markups(markups)
-            fixed_markups = split_overlapping_ranges(parsed_markups)
-
-            for markup in fixed_markups:
-                text_formater.set_template(markup["start"], markup["end"], markup["template"])
-
-            return text_formater
-
         while len(paragraphs) > current_pos:
             paragraph = paragraphs[current_pos]
             logger.trace(f"Current paragraph #{current_pos} data: {paragraph}")
@@ -144,7 +230,7 @@ class MediumParser:
                     is_paragraph_subtitle = getting_percontage_of_match(paragraph["text"], subtitle) > 80
                     if is_paragraph_subtitle and not subtitle.endswith("…"):
                         logger.trace("Subtitle was detected, ignore...")
-                        subtitle = paragraph["text"]
+                        subtitle = escape_html(paragraph["text"])
                         current_pos += 1
                         continue
                     elif subtitle and subtitle.endswith("…") and len(paragraph["text"]) > 100:
@@ -156,45 +242,42 @@ class MediumParser:
                         continue
 
             if paragraph["text"] is None:
-                text_formater = None
+                text = None
             else:
-                text_formater = parse_paragraph_text(paragraph["text"], paragraph["markups"])
+                markups = list(paragraph["markups"])
 
                 for highlight in highlights:
                     for highlight_paragraph in highlight["paragraphs"]:
                         if highlight_paragraph["name"] == paragraph["name"]:
                             logger.trace("Apply highlight to this paragraph")
-                            if highlight_paragraph["text"] != text_formater.get_text():
+                            if highlight_paragraph["text"] != paragraph["text"]:
                                 logger.warning("Highlighted text and paragraph text are not the same! Skip...")
                                 break
-                            quote_markup_template = '<mark style="background-color: rgb(200 227 200);">{{ text }}</mark>'
-                            text_formater.set_template(
-                                highlight["startOffset"],
-                                highlight["endOffset"],
-                                quote_markup_template,
-                            )
+                            markups.append({"type": HIGHLIGHT_MARKUP_TYPE, "start": highlight["startOffset"], "end": highlight["endOffset"]})
                             break
 
+                text = render_markup_text(paragraph["text"], markups)
+
             if paragraph["type"] == "H2":
                 css_class = []
                 if out_paragraphs:
                     css_class.append("pt-12")
                 header_template = jinja_env.from_string('<h2 class="font-bold font-sans break-normal text-gray-900 dark:text-gray-100 text-1xl md:text-2xl {{ css_class }}">{{ text }}</h2>')
-                header_template_rendered = await header_template.render_async(text=text_formater.get_text(), css_class="".join(css_class))
+                header_template_rendered = await header_template.render_async(text=text, css_class="".join(css_class))
                 out_paragraphs.append(header_template_rendered)
             elif paragraph["type"] == "H3":
                 css_class = []
                 if out_paragraphs:
                     css_class.append("pt-12")
                 header_template = jinja_env.from_string('<h3 class="font-bold font-sans break-normal text-gray-900 dark:text-gray-100 text-1xl md:text-2xl {{ css_class }}">{{ text }}</h3>')
-                header_template_rendered = await header_template.render_async(text=text_formater.get_text(), css_class="".join(css_class))
+                header_template_rendered = await header_template.render_async(text=text, css_class="".join(css_class))
                 out_paragraphs.append(header_template_rendered)
             elif paragraph["type"] == "H4":
                 css_class = []
                 if out_paragraphs:
                     css_class.append("pt-8")
                 header_template = jinja_env.from_string('<h4 class="font-bold font-sans break-normal text-gray-900 dark:text-gray-100 text-l md:text-xl {{ css_class }}">{{ text }}</h4>')
-                header_template_rendered = await header_template.render_async(text=text_formater.get_text(), css_class="".join(css_class))
+                header_template_rendered = await header_template.render_async(text=text, css_class="".join(css_class))
                 out_paragraphs.append(header_template_rendered)
             elif paragraph["type"] == "IMG":
                 image_template = jinja_env.from_string(
@@ -227,7 +310,7 @@ class MediumParser:
                     image_template_rendered = await image_template.render_async(paragraph=paragraph)
                     out_paragraphs.append(image_template_rendered)
                     if paragraph["text"]:
-                        out_paragraphs.append(await image_caption_template.render_async(text=text_formater.get_text()))
+                        out_paragraphs.append(await image_caption_template.render_async(text=text))
             elif paragraph["type"] == "P":
                 css_class = ["leading-8"]
                 paragraph_template = jinja_env.from_string('<p class="{{ css_class }}">{{ text }}</p>')
@@ -235,7 +318,7 @@ class MediumParser:
                     css_class.append("mt-3")
                 else:
                     css_class.append("mt-7")
-                paragraph_template_rendered = await paragraph_template.render_async(text=text_formater.get_text(), css_class=" ".join(css_class))
+                paragraph_template_rendered = await paragraph_template.render_async(text=text, css_class=" ".join(css_class))
                 out_paragraphs.append(paragraph_template_rendered)
             elif paragraph["type"] == "ULI":
                 uli_template = jinja_env.from_string('<ul class="list-disc pl-8 mt-2">{{ li }}</ul>')
@@ -246,8 +329,7 @@ class MediumParser:
                 while len(paragraphs) > _tmp_current_pos:
                     _paragraph = paragraphs[_tmp_current_pos]
                     if _paragraph["type"] == "ULI":
-                        text_formater = parse_paragraph_text(_paragraph["text"], _paragraph["markups"])
-                        li_template_rendered = await li_template.render_async(text=text_formater.get_text())
+                        li_template_rendered = await li_template.render_async(text=render_markup_text(_paragraph["text"], _paragraph["markups"]))
                         li_templates.append(li_template_rendered)
                     else:
                         break
@@ -267,8 +349,7 @@ class MediumParser:
                 while len(paragraphs) > _tmp_current_pos:
                     _paragraph = paragraphs[_tmp_current_pos]
                     if _paragraph["type"] == "OLI":
-                        text_formater = parse_paragraph_text(_paragraph["text"], _paragraph["markups"])
-                        li_template_rendered = await li_template.render_async(text=text_formater.get_text())
+                        li_template_rendered = await li_template.render_async(text=render_markup_text(_paragraph["text"], _paragraph["markups"]))
                         li_templates.append(li_template_rendered)
                     else:
                         break
@@ -288,16 +369,16 @@ class MediumParser:
                     code_css_class.append('nohighlight')
                     css_class.append('p-4')
                 pre_template = jinja_env.from_string('<pre style="display: flex; flex-direction: column; justify-content: center;" class="{{ css_class }} dark:bg-gray-600"><code style="overflow-x: auto;" class="{{ code_css_class }} dark:bg-gray-600">{{ text }}</code></pre>')
-                pre_template_rendered = await pre_template.render_async(text=text_formater.get_text(), css_class=" ".join(css_class), code_css_class=" ".join(code_css_class))
+                pre_template_rendered = await pre_template.render_async(text=text, css_class=" ".join(css_class), code_css_class=" ".join(code_css_class))
                 out_paragraphs.append(pre_template_rendered)
             elif paragraph["type"] == "BQ":
                 bq_template = jinja_env.from_string('<blockquote style="box-shadow: inset 3px 0 0 0 #242424;" class="px-5 pt-3 pb-3 mt-5"><p style="font-style: italic;">{{ text }}</p></blockquote>')
-                bq_template_rendered = await bq_template.render_async(text=text_formater.get_text())
+                bq_template_rendered = await bq_template.render_async(text=text)
                 logger.trace(bq_template_rendered)
                 out_paragraphs.append(bq_template_rendered)
             elif paragraph["type"] == "PQ":
                 pq_template = jinja_env.from_string('<blockquote class="mt-7 text-2xl ml-5 text-gray-600 dark:text-gray-300"><p>{{ text }}</p></blockquote>')
-                pq_template_rendered = await pq_template.render_async(text=text_formater.get_text())
+                pq_template_rendered = await pq_template.render_async(text=text)
                 logger.trace(pq_template_rendered)
                 out_paragraphs.append(pq_template_rendered)
             elif paragraph["type"] == 'MIXTAPE_EMBED':
@@ -323,6 +404,8 @@ class MediumParser:
 
                 embed_title = text_raw[title_range["start"]:title_range["end"]]
                 embed_description = text_raw[description_range["start"]:description_range["end"]]
+                import tld
+
                 try:
                     embed_site = tld.get_fld(url)
                 except Exception as ex:
@@ -333,29 +416,76 @@ class MediumParser:
                 embed_template_rendered = await embed_template.render_async(paragraph=paragraph, url=url, embed_title=embed_title, embed_description=embed_description, embed_site=embed_site)
                 out_paragraphs.append(embed_template_rendered)
             elif paragraph["type"] == "IFRAME":
-                iframe_template = jinja_env.from_string('<div class="mt-7"><iframe class="lazy" data-src="{{ host_address }}/render_iframe/{{ iframe_id }}" allowfullscreen="" frameborder="0" scrolling="no"></iframe></div>')
-                iframe_template_rendered = await iframe_template.render_async(host_address=self.host_address, iframe_id=paragraph["iframe"]["mediaResource"]["id"])
+                iframe_template = jinja_env.from_string('<div class="mt-7"><iframe class="lazy" data-src="{{ host_address }}/render_iframe/{{ iframe_id }}?post_id={{ post_id }}" allowfullscreen="" frameborder="0" scrolling="no"></iframe></div>')
+                iframe_template_rendered = await iframe_template.render_async(host_address=self.host_address, iframe_id=paragraph["iframe"]["mediaResource"]["id"], post_id=self.post_id)
                 out_paragraphs.append(iframe_template_rendered)
+                media_resource_ids.append(paragraph["iframe"]["mediaResource"]["id"])
 
             else:
                 logger.error(f"Unknown {paragraph['type']}: {paragraph}")
 
             current_pos += 1
 
+        if self.context.prefetch_media_resources and media_resource_ids:
+            # Not awaited, so rendering doesn't wait for it. Until it's done, or if it fails, iframes are still
+            # served, just with a request each
+            self.context.start_background(
+                cache_media_resources(self.post_id, media_resource_ids, self.timeout, self.context, priority=Priority.PREWARM),
+                f"cache media resources of post {self.post_id}",
+            )
+
+        if self.context.prefetch_links:
+            # List items and image rows are consumed by inner loops above, so links are collected from all paragraphs
+            linked_post_ids = [post_id for paragraph in paragraphs for post_id in extract_linked_post_ids(paragraph)]
+            self.context.link_prefetcher.schedule(self.post_id, list(dict.fromkeys(linked_post_ids)))
+
         return out_paragraphs, title, subtitle
 
-    async def render_as_html(self, template_folder: str = './templates'):
+    async def render_as_html(self, template_folder: str = './templates', minify: bool = False, encodings: tuple = (), use_cache: bool = True):
+        """
+        Render post as HTML.
+
+        If `minify` or `encodings` (e.g. ("gzip", "br")) is requested, rendered post is post-processed off the event loop
+        and stored in render cache, so next calls can be served without rendering and compressing again.
+        """
         try:
-            result = await self._render_as_html(template_folder)
+            if minify or encodings:
+                result = await self._render_as_postprocessed_html(template_folder, minify, tuple(encodings), use_cache)
+            else:
+                result = await self._render_as_html(template_folder)
         except Exception as ex:
             raise MediumParserException(ex) from ex
         else:
             return result
 
+    def _render_cache_key(self, template_folder: str, minify: bool) -> str:
+        return rendered_key(self.post_id, self.host_address, template_folder, 'min' if minify else 'raw')
+
+    async def _render_as_postprocessed_html(self, template_folder: str, minify: bool, encodings: tuple, use_cache: bool) -> 'HtmlResult':
+        cache_key = self._render_cache_key(template_folder, minify)
+
+        if use_cache:
+            rendered = self.context.cache.pull_rendered(cache_key)
+            if rendered and all(encoding in rendered.compressed for encoding in encodings):
+                logger.debug("rendered post was found on cache")
+                return HtmlResult(**rendered.json(), compressed=rendered.compressed)
+
+        result = await self._render_as_html(template_folder)
+
+        from .minify import postprocess_html_result
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, postprocess_html_result, result, minify, encodings)
+
+        rendered_data = {"title": result.title, "description": result.description, "url": result.url, "data": result.data}
+        self.context.cache.push_rendered(cache_key, self.post_id, rendered_data, result.compressed)
+
+        return result
+
     async def generate_metadata(self, as_dict: bool = False) -> tuple:
-        title = RLStringHelper(self.post_data["data"]["post"]["title"]).get_text()  # quote_html=False
-        subtitle = RLStringHelper(self.post_data["data"]["post"]["previewContent"]["subtitle"]).get_text()
-        description = RLStringHelper(textwrap.shorten(subtitle, width=100, placeholder="...")).get_text()
+        title = escape_html(self.post_data["data"]["post"]["title"])
+        subtitle = escape_html(self.post_data["data"]["post"]["previewContent"]["subtitle"])
+        description = escape_html(textwrap.shorten(self.post_data["data"]["post"]["previewContent"]["subtitle"], width=100, placeholder="..."))
         preview_image_id = self.post_data["data"]["post"]["previewImage"]["id"]
         creator = self.post_data["data"]["post"]["creator"]
         collection = self.post_data["data"]["post"]["collection"]
@@ -377,6 +507,9 @@ class MediumParser:
             logger.warning(f'No post data found for post ID: {self.post_id}. Querying...')
             await self.query()
 
+        import jinja2
+
+        jinja_env = self.context.jinja_env
         jinja_template = jinja2.Environment(loader=jinja2.FileSystemLoader(template_folder), enable_async=True)
         post_template = jinja_template.get_template('post.html')
 
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from typing import Union
+
+from loguru import logger
+
+from .scheduler import Priority
+
+RATE_LIMIT_WINDOW = 60
+
+
+class AuthCredential:
+    __slots__ = ('name', 'cookies', 'recent_requests', 'total_requests', 'successes', 'throttled', 'unauthorized', 'consecutive_failures', 'consecutive_benches', 'benched_until', 'on_trial')
+
+    def __init__(self, cookies: str, name: str):
+        self.name = name
+        self.cookies = cookies
+        self.recent_requests = deque()
+        self.total_requests = 0
+        self.successes = 0
+        self.throttled = 0
+        self.unauthorized = 0
+        self.consecutive_failures = 0
+        self.consecutive_benches = 0
+        self.benched_until = 0.0
+        self.on_trial = False
+
+    def is_benched(self, now: float = None) -> bool:
+        return self.benched_until > (now or time.monotonic())
+
+    def available_at(self, now: float, max_requests_per_minute: int) -> float:
+        if self.is_benched(now):
+            return self.benched_until
+
+        while self.recent_requests and self.recent_requests[0] <= now - RATE_LIMIT_WINDOW:
+            self.recent_requests.popleft()
+
+        if len(self.recent_requests) >= max_requests_per_minute:
+            return self.recent_requests[0] + RATE_LIMIT_WINDOW
+
+        return now
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        return {
+            "total_requests": self.total_requests,
+            "requests_last_minute": sum(1 for requested_at in self.recent_requests if requested_at > now - RATE_LIMIT_WINDOW),
+            "successes": self.successes,
+            "throttled": self.throttled,
+            "unauthorized": self.unauthorized,
+            "consecutive_failures": self.consecutive_failures,
+            "benched": self.is_benched(now) and not self.on_trial,
+            "on_trial": self.on_trial,
+            "benched_for": max(self.benched_until - now, 0.0),
+        }
+
+    def __repr__(self):
+        # Never expose cookies in logs
+        return f"<AuthCredential {self.name}>"
+
+
+class CredentialPool:
+    """
+    Pool of Medium accounts used to query API.
+
+    Accounts are rotated round-robin, and each of them is kept under `max_requests_per_minute`. `interactive_reserve`
+    share of that budget is kept for interactive requests: refresh and prewarm requests wait once an account has
+    sent `max_requests_per_minute` minus reserved requests within a minute, so background work can't use up budget
+    of user-facing requests. At least one request per minute is always left for background work.
+    Circuit breaker: account is benched right away on 429 (for `Retry-After` or `bench_time` seconds), and after
+    `failure_threshold` consecutive 401/403 responses. Benched account gets a single trial request when bench expires
+    (half-open state), and isn't used for anything else until it's reported, or for `trial_time` seconds if it never
+    is. Successful trial brings account back, failed one (401/403/429) benches it again right away. Every consecutive
+    bench doubles bench time, up to `max_bench_time`.
+    """
+    __slots__ = ('credentials', 'max_requests_per_minute', 'failure_threshold', 'bench_time', 'max_bench_time', 'trial_time', 'interactive_reserve', '_position')
+
+    def __init__(self, credentials: list, max_requests_per_minute: int = 60, failure_threshold: int = 3, bench_time: float = 60, max_bench_time: float = 900, trial_time: float = 30, interactive_reserve: float = 0.25):
+        if not credentials:
+            raise ValueError("Credential pool should contain at least one account")
+
+        self.credentials = credentials
+        self.max_requests_per_minute = max_requests_per_minute
+        self.failure_threshold = failure_threshold
+        self.bench_time = bench_time
+        self.max_bench_time = max_bench_time
+        self.trial_time = trial_time
+        self.interactive_reserve = interactive_reserve
+        self._position = 0
+
+    @classmethod
+    def from_config(cls, auth_cookies: Union[str, list], **kwargs) -> 'CredentialPool':
+        """
+        Build pool from cookies of a single account, a list of them, or a JSON array string
+        (e.g. MEDIUM_AUTH_COOKIES='["uid=...; sid=...", {"name": "backup", "cookies": "uid=...; sid=..."}]').
+        """
+        if isinstance(auth_cookies, str):
+            auth_cookies = json.loads(auth_cookies) if auth_cookies.lstrip().startswith("[") else [auth_cookies]
+
+        credentials = []
+        for i, account in enumerate(auth_cookies):
+            if isinstance(account, dict):
+                credentials.append(AuthCredential(account["cookies"], account.get("name", f"account-{i}")))
+            else:
+                credentials.append(AuthCredential(account, f"account-{i}"))
+
+        return cls(credentials, **kwargs)
+
+    def requests_per_minute(self, priority: Priority) -> int:
+        if priority == Priority.INTERACTIVE:
+            return self.max_requests_per_minute
+
+        reserved = min(math.ceil(self.max_requests_per_minute * self.interactive_reserve), self.max_requests_per_minute - 1)
+        return self.max_requests_per_minute - max(reserved, 0)
+
+    def _try_acquire(self, now: float, priority: Priority = Priority.INTERACTIVE) -> tuple:
+        next_available_at = None
+        requests_per_minute = self.requests_per_minute(priority)
+
+        for _ in range(len(self.credentials)):
+            credential = self.credentials[self._position]
+            self._position = (self._position + 1) % len(self.credentials)
+
+            available_at = credential.available_at(now, requests_per_minute)
+            if available_at <= now:
+                credential.recent_requests.append(now)
+                credential.total_requests += 1
+                if credential.consecutive_benches:
+                    # Bench expired, but account hasn't succeeded since, so this request is a trial
+                    credential.on_trial = True
+                    credential.benched_until = now + self.trial_time
+                    logger.info(f"Medium account {credential.name} gets a trial request")
+                return credential, None
+
+            if next_available_at is None or available_at < next_available_at:
+                next_available_at = available_at
+
+        return None, next_available_at - now
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE) -> AuthCredential:
+        """
+        Get next healthy account with budget left for `priority`, waiting if all of them are benched or rate limited.
+        """
+        while True:
+            credential, wait_time = self._try_acquire(time.monotonic(), priority)
+            if credential is not None:
+                return credential
+
+            log = logger.warning if priority == Priority.INTERACTIVE else logger.debug
+            log(f"All Medium accounts are benched or rate limited for {priority.name.lower()} requests, waiting {wait_time:.2f}s")
+            await asyncio.sleep(wait_time)
+
+    def release_unused(self, credential: AuthCredential) -> None:
+        """
+        Give back account acquired for a request which was never sent, so it doesn't count against rate limit.
+        """
+        if credential.recent_requests:
+            # Any of recent timestamps will do, only their count matters within the window
+            credential.recent_requests.pop()
+        credential.total_requests -= 1
+        if credential.on_trial:
+            credential.on_trial = False
+            credential.benched_until = 0.0
+
+    def report(self, credential: AuthCredential, status: int, retry_after: float = None) -> None:
+        on_trial, credential.on_trial = credential.on_trial, False
+        if on_trial:
+            # Trial is over either way, next request of still half-open account is another trial
+            credential.benched_until = 0.0
+
+        if status == 429:
+            credential.throttled += 1
+            self._bench(credential, retry_after)
+        elif status in (401, 403):
+            credential.unauthorized += 1
+            credential.consecutive_failures += 1
+            if on_trial or credential.consecutive_failures >= self.failure_threshold:
+                self._bench(credential)
+        elif status < 500:
+            credential.successes += 1
+            credential.consecutive_failures = 0
+            credential.consecutive_benches = 0
+        # 5xx responses are Medium's side errors and say nothing about account health
+
+    def _bench(self, credential: AuthCredential, bench_time: float = None) -> None:
+        credential.consecutive_benches += 1
+        if bench_time is None:
+            bench_time = min(self.bench_time * 2 ** (credential.consecutive_benches - 1), self.max_bench_time)
+
+        credential.benched_until = time.monotonic() + bench_time
+        logger.warning(f"Medium account {credential.name} was benched for {bench_time:.1f}s")
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        return {
+            "accounts": len(self.credentials),
+            "healthy_accounts": sum(1 for credential in self.credentials if not credential.is_benched(now)),
+            "per_account": {credential.name: credential.metrics() for credential in self.credentials},
+        }
@@ -1,13 +1,16 @@
+# Run from repository root: python -m medium_parser.db_cache_migration
+import os
 import sqlite3
 import asyncio
 import pickle
-from cache_db import SQLiteCacheBackend
+from medium_parser.cache_db import SQLiteCacheBackend
 
-db_path = "../medium_cache.sqlite"
+# Paths are relative to this script, so they point to the same files when run with -m from repository root
+db_path = os.path.join(os.path.dirname(__file__), "..", "medium_cache.sqlite")
 
 async def main():
     conn = sqlite3.connect(db_path)
-    db_cache = SQLiteCacheBackend("medium_db_cache.sqlite")
+    db_cache = SQLiteCacheBackend(os.path.join(os.path.dirname(__file__), "medium_db_cache.sqlite"))
     db_cache.init_db()
 
     c = conn.cursor()
@@ -28,4 +31,5 @@ async def main():
 
     db_cache.close()
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(main())
\ No newline at end of file
@@ -24,3 +24,7 @@ class InvalidMediumPostID(MediumParserException):
 
 class MediumPostQueryError(MediumParserException):
     pass
+
+
+class DeadlineExceeded(MediumParserException):
+    pass
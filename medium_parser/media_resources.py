@@ -0,0 +1,51 @@
+from typing import Optional
+
+from loguru import logger
+
+from .context import MediumParserContext, get_context
+from .medium_api import query_media_resources
+from .scheduler import Priority
+from .time import Deadline
+
+# Bounds size of a single GraphQL query for posts with lots of embeds
+MAX_MEDIA_RESOURCES_PER_QUERY = 100
+
+
+async def cache_media_resources(post_id: str, media_resource_ids: list, timeout: int = 3, context: MediumParserContext = None, deadline: Deadline = None, priority: Priority = Priority.INTERACTIVE) -> int:
+    """
+    Fetch media resources of iframes embedded in post which aren't cached yet, in one request, and cache them
+    next to the post. Returns number of newly cached resources.
+    """
+    context = context or get_context()
+    missing = [media_resource_id for media_resource_id in dict.fromkeys(media_resource_ids) if not context.cache.pull_media_resource(media_resource_id)]
+    cached = 0
+
+    for i in range(0, len(missing), MAX_MEDIA_RESOURCES_PER_QUERY):
+        media_resources = await query_media_resources(missing[i:i + MAX_MEDIA_RESOURCES_PER_QUERY], timeout, context, deadline, priority)
+        context.cache.push_media_resources(post_id, list(media_resources.items()))
+        cached += len(media_resources)
+
+    if missing:
+        logger.debug(f"Cached {cached} of {len(missing)} missing media resources of post {post_id}")
+    return cached
+
+
+async def get_media_resource(media_resource_id: str, post_id: str = None, timeout: int = 3, context: MediumParserContext = None, priority: Priority = Priority.INTERACTIVE) -> Optional[dict]:
+    """
+    Media resource data for serving an iframe of post `post_id` (passed in `post_id` query parameter of iframe URL).
+    Resources of rendered posts are served from cache, others are queried from API and cached next to `post_id`,
+    so they're dropped with the post. Resource isn't cached without `post_id` or if that post isn't cached itself,
+    since nothing would ever delete it. Returns None if Medium doesn't know the resource.
+    """
+    context = context or get_context()
+    media_resource = context.cache.pull_media_resource(media_resource_id)
+    if media_resource:
+        return media_resource.json()
+
+    media_resources = await query_media_resources([media_resource_id], timeout, context, priority=priority)
+    if media_resource_id not in media_resources:
+        return None
+
+    if post_id is not None and context.cache.pull(post_id):
+        context.cache.push_media_resources(post_id, [(media_resource_id, media_resources[media_resource_id])])
+    return media_resources[media_resource_id]
@@ -1,17 +1,128 @@
-import aiohttp
-from aiohttp_retry import RetryClient
+import asyncio
+import time
+
 from loguru import logger
 
-from . import retry_options, MEDIUM_AUTH_COOKIES
-from .time import get_unix_ms
-from .utils import generate_random_sha256_hash
+from .context import MediumParserContext, get_context
+from .exceptions import DeadlineExceeded, MediumPostQueryError
+from .scheduler import Priority
+from .time import Deadline, cap_timeout, get_unix_ms
+from .utils import generate_random_sha256_hash, is_valid_media_resource_id, parse_retry_after
+
+# Statuses worth another attempt: Medium side errors, and account issues since next attempt uses another account
+RETRY_STATUSES = (401, 403, 429)
+
+
+class RetryableResponseError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"Medium API responded with {status} status")
+        self.status = status
 
 
 # https://gist.github.com/vladar/a4e3afd608cfe8b13e5844d75447f0a4
-async def query_post_by_id(post_id: str, timeout: int = 3):
+async def query_post_by_id(post_id: str, timeout: int = 3, context: MediumParserContext = None, deadline: Deadline = None, priority: Priority = Priority.INTERACTIVE):
+    """
+    Query full post data by GraphQL API.
+
+    `timeout` is applied to each attempt (including wait for outbound scheduler slot), while `deadline` bounds
+    all of them, including backoff between retries.
+    """
+    json_data = {
+        "operationName": "FullPostQuery",
+        "variables": {
+            "postId": post_id,
+            "postMeteringOptions": {},
+        },
+        "query": "query FullPostQuery($postId: ID!, $postMeteringOptions: PostMeteringOptions) { post(id: $postId) { __typename id ...FullPostData } meterPost(postId: $postId, postMeteringOptions: $postMeteringOptions) { __typename ...MeteringInfoData } }  fragment UserFollowData on User { id socialStats { followingCount followerCount } viewerEdge { isFollowing } }  fragment NewsletterData on NewsletterV3 { id viewerEdge { id isSubscribed } }  fragment UserNewsletterData on User { id newsletterV3 { __typename ...NewsletterData } }  fragment ImageMetadataData on ImageMetadata { id originalWidth originalHeight focusPercentX focusPercentY alt }  fragment CollectionFollowData on Collection { id subscriberCount viewerEdge { isFollowing } }  fragment CollectionNewsletterData on Collection { id newsletterV3 { __typename ...NewsletterData } }  fragment BylineData on Post { id readingTime creator { __typename id imageId username name bio tippingLink viewerEdge { isUser } ...UserFollowData ...UserNewsletterData } collection { __typename id name avatar { __typename id ...ImageMetadataData } ...CollectionFollowData ...CollectionNewsletterData } isLocked firstPublishedAt latestPublishedVersion }  fragment ResponseCountData on Post { postResponses { count } }  fragment InResponseToPost on Post { id title creator { name } clapCount responsesCount isLocked }  fragment PostVisibilityData on Post { id collection { viewerEdge { isEditor canEditPosts canEditOwnPosts } } creator { id } isLocked visibility }  fragment PostMenuData on Post { id title creator { __typename ...UserFollowData } collection { __typename ...CollectionFollowData } }  fragment PostMetaData on Post { __typename id title visibility ...ResponseCountData clapCount viewerEdge { clapCount } detectedLanguage mediumUrl readingTime updatedAt isLocked allowResponses isProxyPost latestPublishedVersion isSeries firstPublishedAt previewImage { id } inResponseToPostResult { __typename ...InResponseToPost } inResponseToMediaResource { mediumQuote { startOffset endOffset paragraphs { text type markups { type start end anchorType } } } } inResponseToEntityType canonicalUrl collection { id slug name shortDescription avatar { __typename id ...ImageMetadataData } viewerEdge { isFollowing isEditor canEditPosts canEditOwnPosts isMuting } } creator { id isFollowing name bio imageId mediumMemberAt twitterScreenName viewerEdge { isBlocking isMuting isUser } } previewContent { subtitle } pinnedByCreatorAt ...PostVisibilityData ...PostMenuData }  fragment LinkMetadataList on Post { linkMetadataList { url alts { type url } } }  fragment MediaResourceData on MediaResource { id iframeSrc thumbnailUrl }  fragment IframeData on Iframe { iframeHeight iframeWidth mediaResource { __typename ...MediaResourceData } }  fragment MarkupData on Markup { name type start end href title rel type anchorType userId creatorIds }  fragment CatalogSummaryData on Catalog { id name description type visibility predefined responsesLocked creator { id name username imageId bio viewerEdge { isUser } } createdAt version itemsLastInsertedAt postItemsCount }  fragment CatalogPreviewData on Catalog { __typename ...CatalogSummaryData id itemsConnection(pagingOptions: { limit: 10 } ) { items { entity { __typename ... on Post { id previewImage { id } } } } paging { count } } }  fragment MixtapeMetadataData on MixtapeMetadata { mediaResourceId href thumbnailImageId mediaResource { mediumCatalog { __typename ...CatalogPreviewData } } }  fragment ParagraphData on Paragraph { id name href text iframe { __typename ...IframeData } layout markups { __typename ...MarkupData } metadata { __typename ...ImageMetadataData } mixtapeMetadata { __typename ...MixtapeMetadataData } type hasDropCap dropCapImage { __typename ...ImageMetadataData } codeBlockMetadata { lang mode } }  fragment QuoteData on Quote { id postId userId startOffset endOffset paragraphs { __typename id ...ParagraphData } quoteType }  fragment HighlightsData on Post { id highlights { __typename ...QuoteData } }  fragment PostFooterCountData on Post { __typename id clapCount viewerEdge { clapCount } ...ResponseCountData responsesLocked mediumUrl title collection { id viewerEdge { isMuting isFollowing } } creator { id viewerEdge { isMuting isFollowing } } }  fragment TagNoViewerEdgeData on Tag { id normalizedTagSlug displayTitle followerCount postCount }  fragment VideoMetadataData on VideoMetadata { videoId previewImageId originalWidth originalHeight }  fragment SectionData on Section { name startIndex textLayout imageLayout videoLayout backgroundImage { __typename ...ImageMetadataData } backgroundVideo { __typename ...VideoMetadataData } }  fragment PostBodyData on RichText { sections { __typename ...SectionData } paragraphs { __typename id ...ParagraphData } }  fragment FullPostData on Post { __typename ...BylineData ...PostMetaData ...LinkMetadataList ...HighlightsData ...PostFooterCountData tags { __typename id ...TagNoViewerEdgeData } content(postMeteringOptions: $postMeteringOptions) { bodyModel { __typename ...PostBodyData } validatedShareKey } }  fragment MeteringInfoData on MeteringInfo { maxUnlockCount unlocksRemaining postIds }",
+    }
+
+    return await _query_graphql(json_data, f"post {post_id}", timeout, context, deadline, priority)
+
+
+async def query_media_resources(media_resource_ids: list, timeout: int = 3, context: MediumParserContext = None, deadline: Deadline = None, priority: Priority = Priority.INTERACTIVE) -> dict:
+    """
+    Query iframe media resources by IDs in a single GraphQL request, each resource aliased in the query.
+    Returns a dict mapping ID to resource data, IDs which Medium doesn't know are left out.
+    """
+    media_resource_ids = [media_resource_id for media_resource_id in dict.fromkeys(media_resource_ids) if is_valid_media_resource_id(media_resource_id)]
+    if not media_resource_ids:
+        return {}
+
+    # IDs are validated to be alphanumeric above, so they are safe to inline as string literals
+    aliases = " ".join(f'm{i}: mediaResource(id: "{media_resource_id}") {{ __typename ...MediaResourceData }}' for i, media_resource_id in enumerate(media_resource_ids))
+    json_data = {
+        "operationName": "MediaResourcesQuery",
+        "variables": {},
+        "query": f"query MediaResourcesQuery {{ {aliases} }}  fragment MediaResourceData on MediaResource {{ id iframeSrc thumbnailUrl }}",
+    }
+
+    response = await _query_graphql(json_data, f"{len(media_resource_ids)} media resources", timeout, context, deadline, priority)
+    if response.get("errors"):
+        logger.debug(f"Media resources query returned errors: {response['errors']}")
+
+    data = response.get("data") or {}
+    return {
+        media_resource_id: data[f"m{i}"]
+        for i, media_resource_id in enumerate(media_resource_ids)
+        if data.get(f"m{i}")
+    }
+
+
+async def _query_graphql(json_data: dict, description: str, timeout: int, context: MediumParserContext, deadline: Deadline, priority: Priority):
+    import aiohttp
+
+    context = context or get_context()
+    deadline = Deadline.coerce(deadline)
+    retry_options = context.retry_options
+
+    last_error = None
+    async with aiohttp.ClientSession() as session:
+        for attempt in range(retry_options.attempts):
+            attempt_timeout = cap_timeout(timeout, deadline)
+            try:
+                if context.hedge_requests:
+                    return await _hedged_graphql_request(session, json_data, attempt_timeout, context, priority)
+                return await _graphql_request(session, json_data, attempt_timeout, context, priority)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RetryableResponseError) as ex:
+                logger.debug(f"Attempt #{attempt + 1} to query {description} failed: {ex!r}")
+                last_error = ex
+
+            if attempt + 1 == retry_options.attempts:
+                break
+
+            backoff = retry_options.get_timeout(attempt)
+            if deadline is not None and deadline.remaining() <= backoff:
+                raise DeadlineExceeded(f"Deadline exceeded while querying {description}") from last_error
+            await asyncio.sleep(backoff)
+
+    # Last attempt may have failed only because it was cut short by the deadline
+    if deadline is not None and deadline.expired:
+        raise DeadlineExceeded(f"Deadline exceeded while querying {description}") from last_error
+    raise MediumPostQueryError(f"Could not query {description} after {retry_options.attempts} attempts") from last_error
+
+
+async def _graphql_request(session, json_data: dict, timeout: float, context: MediumParserContext, priority: Priority):
+    started_at = time.monotonic()
+    # Account first, so waiting for a rate limited or benched account doesn't hold a scheduler slot
+    credential = await asyncio.wait_for(context.credential_pool.acquire(priority), timeout)
+    try:
+        await asyncio.wait_for(context.scheduler.acquire(priority), max(timeout - (time.monotonic() - started_at), 0.001))
+    except BaseException:
+        context.credential_pool.release_unused(credential)
+        raise
+
+    try:
+        return await _send_graphql_request(session, json_data, max(timeout - (time.monotonic() - started_at), 0.001), context, credential)
+    finally:
+        context.scheduler.release()
+
+
+async def _send_graphql_request(session, json_data: dict, timeout: float, context: MediumParserContext, credential):
+    import aiohttp
+
     headers = {
         "X-APOLLO-OPERATION-ID": generate_random_sha256_hash(),
-        "X-APOLLO-OPERATION-NAME": "FullPostQuery",
+        "X-APOLLO-OPERATION-NAME": json_data["operationName"],
         "Accept": "multipart/mixed; deferSpec=20220824, application/json, application/json",
         "Accept-Language": "en-US",
         "X-Obvious-CID": "android",
@@ -21,28 +132,53 @@ async def query_post_by_id(post_id: str, timeout: int = 3):
         "Cache-Control": "public, max-age=-1",
         "Content-Type": "application/json",
         "Connection": "Keep-Alive",
-        "Cookie": MEDIUM_AUTH_COOKIES,
+        "Cookie": credential.cookies,
     }
 
-    json_data = {
-        "operationName": "FullPostQuery",
-        "variables": {
-            "postId": post_id,
-            "postMeteringOptions": {},
-        },
-        "query": "query FullPostQuery($postId: ID!, $postMeteringOptions: PostMeteringOptions) { post(id: $postId) { __typename id ...FullPostData } meterPost(postId: $postId, postMeteringOptions: $postMeteringOptions) { __typename ...MeteringInfoData } }  fragment UserFollowData on User { id socialStats { followingCount followerCount } viewerEdge { isFollowing } }  fragment NewsletterData on NewsletterV3 { id viewerEdge { id isSubscribed } }  fragment UserNewsletterData on User { id newsletterV3 { __typename ...NewsletterData } }  fragment ImageMetadataData on ImageMetadata { id originalWidth originalHeight focusPercentX focusPercentY alt }  fragment CollectionFollowData on Collection { id subscriberCount viewerEdge { isFollowing } }  fragment CollectionNewsletterData on Collection { id newsletterV3 { __typename ...NewsletterData } }  fragment BylineData on Post { id readingTime creator { __typename id imageId username name bio tippingLink viewerEdge { isUser } ...UserFollowData ...UserNewsletterData } collection { __typename id name avatar { __typename id ...ImageMetadataData } ...CollectionFollowData ...CollectionNewsletterData } isLocked firstPublishedAt latestPublishedVersion }  fragment ResponseCountData on Post { postResponses { count } }  fragment InResponseToPost on Post { id title creator { name } clapCount responsesCount isLocked }  fragment PostVisibilityData on Post { id collection { viewerEdge { isEditor canEditPosts canEditOwnPosts } } creator { id } isLocked visibility }  fragment PostMenuData on Post { id title creator { __typename ...UserFollowData } collection { __typename ...CollectionFollowData } }  fragment PostMetaData on Post { __typename id title visibility ...ResponseCountData clapCount viewerEdge { clapCount } detectedLanguage mediumUrl readingTime updatedAt isLocked allowResponses isProxyPost latestPublishedVersion isSeries firstPublishedAt previewImage { id } inResponseToPostResult { __typename ...InResponseToPost } inResponseToMediaResource { mediumQuote { startOffset endOffset paragraphs { text type markups { type start end anchorType } } } } inResponseToEntityType canonicalUrl collection { id slug name shortDescription avatar { __typename id ...ImageMetadataData } viewerEdge { isFollowing isEditor canEditPosts canEditOwnPosts isMuting } } creator { id isFollowing name bio imageId mediumMemberAt twitterScreenName viewerEdge { isBlocking isMuting isUser } } previewContent { subtitle } pinnedByCreatorAt ...PostVisibilityData ...PostMenuData }  fragment LinkMetadataList on Post { linkMetadataList { url alts { type url } } }  fragment MediaResourceData on MediaResource { id iframeSrc thumbnailUrl }  fragment IframeData on Iframe { iframeHeight iframeWidth mediaResource { __typename ...MediaResourceData } }  fragment MarkupData on Markup { name type start end href title rel type anchorType userId creatorIds }  fragment CatalogSummaryData on Catalog { id name description type visibility predefined responsesLocked creator { id name username imageId bio viewerEdge { isUser } } createdAt version itemsLastInsertedAt postItemsCount }  fragment CatalogPreviewData on Catalog { __typename ...CatalogSummaryData id itemsConnection(pagingOptions: { limit: 10 } ) { items { entity { __typename ... on Post { id previewImage { id } } } } paging { count } } }  fragment MixtapeMetadataData on MixtapeMetadata { mediaResourceId href thumbnailImageId mediaResource { mediumCatalog { __typename ...CatalogPreviewData } } }  fragment ParagraphData on Paragraph { id name href text iframe { __typename ...IframeData } layout markups { __typename ...MarkupData } metadata { __typename ...ImageMetadataData } mixtapeMetadata { __typename ...MixtapeMetadataData } type hasDropCap dropCapImage { __typename ...ImageMetadataData } codeBlockMetadata { lang mode } }  fragment QuoteData on Quote { id postId userId startOffset endOffset paragraphs { __typename id ...ParagraphData } quoteType }  fragment HighlightsData on Post { id highlights { __typename ...QuoteData } }  fragment PostFooterCountData on Post { __typename id clapCount viewerEdge { clapCount } ...ResponseCountData responsesLocked mediumUrl title collection { id viewerEdge { isMuting isFollowing } } creator { id viewerEdge { isMuting isFollowing } } }  fragment TagNoViewerEdgeData on Tag { id normalizedTagSlug displayTitle followerCount postCount }  fragment VideoMetadataData on VideoMetadata { videoId previewImageId originalWidth originalHeight }  fragment SectionData on Section { name startIndex textLayout imageLayout videoLayout backgroundImage { __typename ...ImageMetadataData } backgroundVideo { __typename ...VideoMetadataData } }  fragment PostBodyData on RichText { sections { __typename ...SectionData } paragraphs { __typename id ...ParagraphData } }  fragment FullPostData on Post { __typename ...BylineData ...PostMetaData ...LinkMetadataList ...HighlightsData ...PostFooterCountData tags { __typename id ...TagNoViewerEdgeData } content(postMeteringOptions: $postMeteringOptions) { bodyModel { __typename ...PostBodyData } validatedShareKey } }  fragment MeteringInfoData on MeteringInfo { maxUnlockCount unlocksRemaining postIds }",
-    }
+    request_started_at = time.monotonic()
+    async with session.post("https://medium.com/_/graphql", headers=headers, json=json_data, timeout=aiohttp.ClientTimeout(total=timeout)) as request:
+        context.credential_pool.report(credential, request.status, parse_retry_after(request.headers.get("Retry-After")))
+        logger.trace(request.headers)
+
+        if request.status >= 500 or request.status in RETRY_STATUSES:
+            raise RetryableResponseError(request.status)
 
-    async with aiohttp.ClientSession() as session:
-        retry_client = RetryClient(client_session=session, raise_for_status=False, retry_options=retry_options)
-        request = await retry_client.post(
-                "https://medium.com/_/graphql",
-                headers=headers,
-                json=json_data,
-                timeout=timeout,
-        )
         response = await request.json()
 
-    logger.trace(request.headers)
+    context.api_latency.record(time.monotonic() - request_started_at)
 
     return response
+
+
+async def _hedged_graphql_request(session, json_data: dict, timeout: float, context: MediumParserContext, priority: Priority):
+    """
+    Fire a second request if the first one is slower than usual, and keep whichever succeeds first.
+    """
+    hedge_delay = context.api_latency.percentile(context.hedge_percentile)
+    if hedge_delay is None or hedge_delay >= timeout:
+        return await _graphql_request(session, json_data, timeout, context, priority)
+
+    started_at = time.monotonic()
+    pending = {asyncio.ensure_future(_graphql_request(session, json_data, timeout, context, priority))}
+
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+        if not done:
+            logger.debug(f"Request is slower than {hedge_delay:.2f}s, firing hedged request")
+            hedge_timeout = max(timeout - (time.monotonic() - started_at), 0.001)
+            pending.add(asyncio.ensure_future(_graphql_request(session, json_data, hedge_timeout, context, priority)))
+        else:
+            pending = done
+
+        last_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
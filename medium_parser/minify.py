@@ -0,0 +1,57 @@
+import gzip
+from dataclasses import replace
+from warnings import warn
+
+from .models.html_result import HtmlResult
+
+try:
+    import minify_html
+except ImportError:
+    warn("Can't minify rendered HTML. Please install 'minify-html' package")
+    minify_html = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SUPPORTED_ENCODINGS = ("gzip", "br")
+
+
+def minify_html_string(html: str) -> str:
+    if minify_html is None:
+        raise ValueError("Can't minify rendered HTML. Please install 'minify-html' package")
+
+    # Rendered post is a fragment that gets embedded into a base template, so keep closing tags
+    return minify_html.minify(html, keep_closing_tags=True, minify_css=True, minify_js=True)
+
+
+def compress_html_string(html: str, encodings: tuple = SUPPORTED_ENCODINGS) -> dict:
+    """
+    Pre-compress HTML for each requested Content-Encoding.
+
+    Returns a dict mapping encoding name ("gzip", "br") to compressed bytes.
+    """
+    raw_data = html.encode("utf-8")
+    compressed = {}
+
+    for encoding in encodings:
+        if encoding == "gzip":
+            compressed["gzip"] = gzip.compress(raw_data, compresslevel=9, mtime=0)
+        elif encoding == "br":
+            if brotli is None:
+                raise ValueError("Can't use brotli compression. Please install 'brotli' package")
+            compressed["br"] = brotli.compress(raw_data, quality=11)
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}. Supported encodings: {', '.join(SUPPORTED_ENCODINGS)}")
+
+    return compressed
+
+
+def postprocess_html_result(result: HtmlResult, minify: bool = True, encodings: tuple = ()) -> HtmlResult:
+    """
+    Minify and pre-compress rendered post. CPU bound, so should be run in executor.
+    """
+    data = minify_html_string(result.data) if minify else result.data
+    compressed = compress_html_string(data, encodings) if encodings else {}
+    return replace(result, data=data, compressed=compressed)
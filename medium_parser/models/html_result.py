@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 @dataclass
@@ -7,3 +7,5 @@ class HtmlResult:
     description: str
     url: str
     data: str
+    # Pre-compressed `data`, keyed by Content-Encoding ("gzip", "br")
+    compressed: dict = field(default_factory=dict)
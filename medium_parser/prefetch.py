@@ -0,0 +1,118 @@
+import asyncio
+
+from loguru import logger
+
+from .context import MediumParserContext, get_context
+from .medium_api import query_post_by_id
+from .scheduler import Priority
+from .utils import is_known_medium_url, parse_medium_post_id_locally
+
+
+def extract_linked_post_ids(paragraph: dict) -> list:
+    """
+    Medium post IDs linked from paragraph: mixtape embed card and inline links. Only URLs on known Medium domains
+    are considered, so links to other sites ending with something ID-like aren't mistaken for posts.
+    """
+    urls = []
+    if paragraph["type"] == "MIXTAPE_EMBED" and paragraph.get("mixtapeMetadata"):
+        urls.append(paragraph["mixtapeMetadata"].get("href"))
+    for markup in paragraph.get("markups") or ():
+        if markup["type"] == "A" and markup.get("anchorType") != "USER":
+            urls.append(markup.get("href"))
+
+    post_ids = []
+    for url in urls:
+        if url and is_known_medium_url(url):
+            post_id = parse_medium_post_id_locally(url)
+            if post_id and post_id not in post_ids:
+                post_ids.append(post_id)
+    return post_ids
+
+
+class LinkPrefetcher:
+    """
+    Background fetch of posts linked from rendered posts into cache, so following a link is a cache hit.
+
+    Up to `max_links_per_post` links of every rendered post are prefetched with prewarm priority, so they never
+    delay interactive requests. Posts which are cached, known to be unqueryable or already being prefetched are
+    skipped, and new links are dropped while `max_pending` prefetches are in progress.
+    """
+    __slots__ = ('context', 'timeout', 'max_links_per_post', 'max_pending', 'scheduled', 'fetched', 'skipped', 'dropped', 'failed', '_pending')
+
+    def __init__(self, context: MediumParserContext = None, timeout: int = 10, max_links_per_post: int = 5, max_pending: int = 100):
+        self.context = context or get_context()
+        self.timeout = timeout
+        self.max_links_per_post = max_links_per_post
+        self.max_pending = max_pending
+        self.scheduled = 0
+        self.fetched = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.failed = 0
+        self._pending = {}
+
+    def schedule(self, post_id: str, linked_post_ids: list) -> int:
+        """
+        Start prefetch of posts linked from `post_id`. Must be called from a running event loop.
+        """
+        scheduled = 0
+        for linked_post_id in linked_post_ids:
+            if scheduled >= self.max_links_per_post:
+                break
+            if linked_post_id == post_id or linked_post_id in self._pending:
+                continue
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                continue
+
+            task = asyncio.ensure_future(self._prefetch(linked_post_id))
+            self._pending[linked_post_id] = task
+            task.add_done_callback(lambda _, linked_post_id=linked_post_id: self._pending.pop(linked_post_id, None))
+            scheduled += 1
+
+        self.scheduled += scheduled
+        if scheduled:
+            logger.trace(f"Scheduled prefetch of {scheduled} posts linked from {post_id}")
+        return scheduled
+
+    async def _prefetch(self, post_id: str) -> None:
+        cache = self.context.cache
+        # Checked here rather than in `schedule`, so rendering doesn't wait for cache reads
+        if cache.pull(post_id) or self.context.is_known_unqueryable(post_id):
+            self.skipped += 1
+            return
+
+        try:
+            post_data = await query_post_by_id(post_id, self.timeout, self.context, priority=Priority.PREWARM)
+        except Exception as ex:
+            logger.debug(f"Can't prefetch linked post {post_id}: {ex!r}")
+            self.failed += 1
+            return
+
+        if not isinstance(post_data, dict):
+            self.failed += 1
+            return
+
+        if post_data.get("error") or not (post_data.get("data") or {}).get("post"):
+            self.failed += 1
+            self.context.remember_unqueryable(post_id, post_data)
+            return
+
+        # Sharded backend flushes it within its flush interval, so other workers see it by the next click.
+        # Not recorded as post access, nobody has read it yet
+        cache.replace_post(post_id, post_data)
+        self.fetched += 1
+
+    async def wait(self) -> None:
+        """
+        Wait for prefetches in progress, e.g. before shutdown.
+        """
+        while self._pending:
+            await asyncio.gather(*list(self._pending.values()), return_exceptions=True)
+
+    def cancel(self) -> None:
+        for task in list(self._pending.values()):
+            task.cancel()
+
+    def metrics(self) -> dict:
+        return {"pending": len(self._pending), "scheduled": self.scheduled, "fetched": self.fetched, "skipped": self.skipped, "dropped": self.dropped, "failed": self.failed}
@@ -0,0 +1,180 @@
+import asyncio
+import math
+import time
+from typing import Optional
+
+from loguru import logger
+
+from .cache_db import CacheResponse
+from .context import MediumParserContext, get_context
+from .medium_api import query_post_by_id
+from .scheduler import Priority
+
+
+class CacheRefresher:
+    """
+    Background job which re-queries cached posts, so edited posts don't stay stale forever.
+
+    Cache backend schedules every pushed post for its first refresh, and every process adds post hits (recorded by
+    `MediumParser.query`) to the schedule in cache, so refresher may run in its own process. After each refresh,
+    post gets its next refresh time from its age and popularity: refresh interval is `age_factor` of time passed
+    since post's `updatedAt`, shortened by log of post hits, and clamped to [`min_refresh_interval`,
+    `max_refresh_interval`]. So fresh and popular posts are revisited often, and old forgotten ones rarely.
+
+    Due posts are claimed for `lease_time` seconds before querying, so several refreshers never refresh the same post,
+    and re-queried in batches with refresh priority. Payload is replaced (dropping outdated rendered output in the
+    same transaction) only if `updatedAt` has changed.
+
+        refresher = CacheRefresher(context)
+        refresher.seed()  # schedule posts cached before refresher was introduced, reads every cached payload once
+        refresher.start()
+    """
+    __slots__ = ('context', 'timeout', 'interval', 'batch_size', 'concurrency', 'age_factor', 'min_refresh_interval', 'max_refresh_interval', 'lease_time', 'refreshed', 'updated', 'failed', '_task')
+
+    def __init__(self, context: MediumParserContext = None, timeout: int = 10, interval: float = 60, batch_size: int = 20, concurrency: int = 4, age_factor: float = 0.1, min_refresh_interval: float = 3600, max_refresh_interval: float = 30 * 86400, lease_time: float = 600):
+        self.context = context or get_context()
+        self.timeout = timeout
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.age_factor = age_factor
+        self.min_refresh_interval = min_refresh_interval
+        self.max_refresh_interval = max_refresh_interval
+        self.lease_time = lease_time
+        self.refreshed = 0
+        self.updated = 0
+        self.failed = 0
+        self._task = None
+
+    def refresh_interval(self, hits: int, post_updated_at: float, now: float) -> float:
+        age = max(now - post_updated_at, 0)
+        interval = age * self.age_factor / (1 + math.log1p(hits))
+        return min(max(interval, self.min_refresh_interval), self.max_refresh_interval)
+
+    def _schedule_row(self, key: str, hits: int, post_updated_at: float, refreshed_at: float) -> tuple:
+        return key, hits, post_updated_at, refreshed_at, refreshed_at + self.refresh_interval(hits, post_updated_at, refreshed_at)
+
+    @staticmethod
+    def _get_post_updated_at(post_data: dict) -> float:
+        return post_data["data"]["post"]["updatedAt"] / 1000
+
+    def sync_hits(self) -> int:
+        """
+        Add post hits recorded by this process to refresh schedule right away.
+        """
+        return self.context.flush_post_hits()
+
+    def seed(self, page_size: int = 500) -> int:
+        """
+        Schedule every cached post which isn't scheduled yet.
+        """
+        cache = self.context.cache
+        now = time.time()
+        scheduled = 0
+        page = []
+
+        def schedule_page():
+            known = cache.pull_refresh_schedule([key for key, _ in page])
+            rows = [self._schedule_row(key, 0, post_updated_at, now) for key, post_updated_at in page if key not in known]
+            cache.push_refresh_schedule(rows)
+            return len(rows)
+
+        for key, value in cache.iter_items(page_size):
+            try:
+                page.append((key, self._get_post_updated_at(CacheResponse(value).json())))
+            except (KeyError, TypeError, ValueError):
+                # Not a post payload
+                continue
+
+            if len(page) >= page_size:
+                scheduled += schedule_page()
+                page = []
+
+        if page:
+            scheduled += schedule_page()
+
+        logger.info(f"Scheduled refresh of {scheduled} cached posts")
+        return scheduled
+
+    def _get_cached_post_updated_at(self, key: str) -> Optional[float]:
+        post_data = self.context.cache.pull(key)
+        try:
+            return self._get_post_updated_at(post_data.json())
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+
+    async def _refresh(self, key: str, schedule: tuple, semaphore: asyncio.Semaphore) -> None:
+        hits, post_updated_at, _, _ = schedule
+        if post_updated_at is None:
+            # Scheduled by push, which doesn't parse payload
+            post_updated_at = self._get_cached_post_updated_at(key)
+        # Decay popularity, so posts which aren't read anymore drift to rare refreshes
+        hits //= 2
+
+        async with semaphore:
+            try:
+                post_data = await query_post_by_id(key, self.timeout, self.context, priority=Priority.REFRESH)
+            except Exception as ex:
+                logger.warning(f"Can't refresh post {key}: {ex!r}")
+                post_data = None
+
+        now = time.time()
+        self.refreshed += 1
+
+        if not isinstance(post_data, dict) or post_data.get("error") or not (post_data.get("data") or {}).get("post"):
+            # Keep serving cached payload, and retry later
+            self.failed += 1
+            self.context.cache.push_refresh_schedule([(key, hits, post_updated_at, now, now + self.min_refresh_interval)])
+            return
+
+        new_post_updated_at = self._get_post_updated_at(post_data)
+        if new_post_updated_at != post_updated_at:
+            logger.debug(f"Post {key} was updated, replacing cached payload")
+            self.context.cache.replace_post(key, post_data)
+            self.updated += 1
+
+        self.context.cache.push_refresh_schedule([self._schedule_row(key, hits, new_post_updated_at, now)])
+
+    async def refresh_due(self) -> int:
+        cache = self.context.cache
+        now = time.time()
+        keys = cache.due_refreshes(now, self.batch_size)
+        if not keys:
+            return 0
+
+        schedule = cache.pull_refresh_schedule(keys)
+        # Other refreshers may have claimed some of them in the meantime
+        claimed = cache.claim_refreshes({key: schedule[key][3] for key in keys if key in schedule}, now + self.lease_time)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._refresh(key, schedule[key], semaphore) for key in claimed))
+        return len(keys)
+
+    async def run_once(self) -> int:
+        self.sync_hits()
+        return await self.refresh_due()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                refreshed = await self.run_once()
+            except Exception as ex:
+                logger.exception(ex)
+                refreshed = 0
+
+            # Keep going without pause while there is a backlog of due posts
+            if refreshed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {"refreshed": self.refreshed, "updated": self.updated, "failed": self.failed}
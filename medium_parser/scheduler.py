@@ -0,0 +1,127 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+from .time import LatencyTracker
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    REFRESH = 1
+    PREWARM = 2
+
+
+class OutboundScheduler:
+    """
+    Gate for every outbound request to Medium.
+
+    At most `max_concurrency` requests are in flight, and new ones are started at most `rate` per second
+    (token bucket with `burst` capacity). Waiting requests are served by priority (interactive > refresh > prewarm),
+    then in arrival order.
+
+        async with scheduler.slot(Priority.INTERACTIVE):
+            ...
+    """
+    __slots__ = ('max_concurrency', 'rate', 'burst', '_tokens', '_refilled_at', '_in_flight', '_waiters', '_counter', '_wakeup_handle', 'wait_time', 'requests')
+
+    def __init__(self, max_concurrency: int = 32, rate: float = 20, burst: int = 40):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._waiters = []
+        self._counter = itertools.count()
+        self._wakeup_handle = None
+        self.wait_time = {priority: LatencyTracker(min_samples=1) for priority in Priority}
+        self.requests = {priority: 0 for priority in Priority}
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        self._refill(now)
+
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+
+            if self._in_flight >= self.max_concurrency:
+                return
+
+            if self._tokens < 1:
+                self._schedule_wakeup((1 - self._tokens) / self.rate)
+                return
+
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._in_flight += 1
+            future.set_result(None)
+
+    def _schedule_wakeup(self, delay: float) -> None:
+        if self._wakeup_handle is not None:
+            return
+
+        def wakeup():
+            self._wakeup_handle = None
+            self._dispatch()
+
+        self._wakeup_handle = asyncio.get_running_loop().call_later(delay, wakeup)
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE) -> None:
+        started_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted right before cancellation, give it back
+                self.release()
+            raise
+
+        self.wait_time[priority].record(time.monotonic() - started_at)
+        self.requests[priority] += 1
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.INTERACTIVE, timeout: float = None):
+        """
+        Hold a slot for the body of `async with`. Waiting for it longer than `timeout` raises `asyncio.TimeoutError`.
+        """
+        if timeout is None:
+            await self.acquire(priority)
+        else:
+            await asyncio.wait_for(self.acquire(priority), timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self) -> dict:
+        queue_depth = {priority.name.lower(): 0 for priority in Priority}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                queue_depth[Priority(priority).name.lower()] += 1
+
+        return {
+            "in_flight": self._in_flight,
+            "queue_depth": queue_depth,
+            "requests": {priority.name.lower(): count for priority, count in self.requests.items()},
+            "wait_time_p50": {priority.name.lower(): tracker.percentile(50) for priority, tracker in self.wait_time.items()},
+            "wait_time_p95": {priority.name.lower(): tracker.percentile(95) for priority, tracker in self.wait_time.items()},
+        }
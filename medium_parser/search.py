@@ -0,0 +1,49 @@
+import hashlib
+from html import escape
+from typing import Optional
+
+SEARCH_FIELDS = ("title", "subtitle", "creator", "collection", "tags", "body")
+
+
+def extract_search_document(post_data: dict) -> Optional[dict]:
+    """
+    Pick searchable fields out of cached post payload. Returns None if payload isn't a post.
+    """
+    if not isinstance(post_data, dict):
+        return None
+
+    post = (post_data.get("data") or {}).get("post")
+    if not post:
+        return None
+
+    creator = post.get("creator") or {}
+    paragraphs = ((post.get("content") or {}).get("bodyModel") or {}).get("paragraphs") or []
+
+    return {
+        "title": post.get("title") or "",
+        "subtitle": (post.get("previewContent") or {}).get("subtitle") or "",
+        "creator": " ".join(filter(None, (creator.get("name"), creator.get("username")))),
+        "collection": (post.get("collection") or {}).get("name") or "",
+        "tags": " ".join(tag["displayTitle"] for tag in post.get("tags") or [] if tag.get("displayTitle")),
+        "body": "\n".join(paragraph["text"] for paragraph in paragraphs if paragraph.get("text")),
+    }
+
+
+def search_rowid(key: str) -> int:
+    # Stable 63-bit rowid of a key, so index rows can be replaced and deleted without scanning by key
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big") >> 1
+
+
+def quote_search_query(query: str) -> str:
+    """
+    Turn user input into FTS5 query matching all words, so quotes and operators in it can't break query syntax.
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+SNIPPET_OPEN, SNIPPET_CLOSE = "\x02", "\x03"
+
+
+def highlight_snippet(snippet: str) -> str:
+    # Snippet is plain post text, escape it and only then turn match markers into tags
+    return escape(snippet, quote=False).replace(SNIPPET_OPEN, "<mark>").replace(SNIPPET_CLOSE, "</mark>")
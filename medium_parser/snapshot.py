@@ -0,0 +1,236 @@
+"""
+Cache snapshots, for bootstrapping new nodes without re-querying every post from Medium.
+
+Snapshot is a directory of zstd-compressed JSON lines chunks and `manifest.json`, which lists chunks with their row
+counts and checksums. Manifest is written last, so a directory without it is an unfinished export.
+
+    manifest = export_snapshot(cache, "snapshots/full")
+    export_snapshot(cache, "snapshots/incremental-1", since=manifest["created_at"])
+
+    import_snapshot(new_cache, "snapshots/full")
+    import_snapshot(new_cache, "snapshots/incremental-1")
+"""
+import base64
+import hashlib
+import json
+import os
+import time
+from typing import Iterator
+from warnings import warn
+
+from loguru import logger
+
+from .cache_db import CacheBackend
+
+try:
+    import zstandard
+except ImportError:
+    warn("Can't export or import cache snapshots. Please install 'zstandard' package")
+    zstandard = None
+
+SNAPSHOT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# Chunks are hashed and decompressed this many bytes at a time
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def _require_zstandard() -> None:
+    if zstandard is None:
+        raise ValueError("Can't export or import cache snapshots. Please install 'zstandard' package")
+
+
+class _HashingFile:
+    """
+    Write-only file wrapper which keeps sha256 and size of everything written through it.
+    """
+    __slots__ = ('file', 'sha256', 'bytes')
+
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self.file.write(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+class _ChunkWriter:
+    """
+    Streams lines of one kind into compressed chunk files, starting a new chunk once `chunk_bytes` of uncompressed
+    lines were written to the current one. Only compressor's window is held in memory, not the whole chunk.
+    """
+    __slots__ = ('directory', 'kind', 'compressor', 'chunk_bytes', 'chunks', '_file', '_writer', '_name', '_rows', '_written')
+
+    def __init__(self, directory: str, kind: str, compressor, chunk_bytes: int, chunks: list):
+        self.directory = directory
+        self.kind = kind
+        self.compressor = compressor
+        self.chunk_bytes = chunk_bytes
+        self.chunks = chunks
+        self._file = None
+        self._writer = None
+
+    def write(self, line: bytes) -> None:
+        if self._writer is None:
+            self._name = f"{self.kind}-{len(self.chunks):05d}.jsonl.zst"
+            self._file = _HashingFile(open(os.path.join(self.directory, self._name), "wb"))
+            self._writer = self.compressor.stream_writer(self._file, closefd=False)
+            self._rows = 0
+            self._written = 0
+
+        self._writer.write(line + b"\n")
+        self._rows += 1
+        self._written += len(line) + 1
+        if self._written >= self.chunk_bytes:
+            self.close()
+
+    def close(self) -> None:
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._file.file.close()
+        self.chunks.append({"file": self._name, "kind": self.kind, "rows": self._rows, "bytes": self._file.bytes, "sha256": self._file.sha256.hexdigest()})
+        self._file = None
+        self._writer = None
+
+
+def _verify_chunk(directory: str, chunk: dict) -> None:
+    sha256 = hashlib.sha256()
+    with open(os.path.join(directory, chunk["file"]), "rb") as file:
+        for block in iter(lambda: file.read(READ_BLOCK_SIZE), b""):
+            sha256.update(block)
+
+    if sha256.hexdigest() != chunk["sha256"]:
+        raise ValueError(f"Snapshot chunk {chunk['file']} is corrupted, checksum doesn't match manifest")
+
+
+def _iter_chunk(directory: str, chunk: dict, decompressor) -> Iterator:
+    """
+    Rows of chunk, decompressed and parsed a block at a time. Checksum is verified before any row is yielded, so a
+    corrupted chunk isn't partially imported.
+    """
+    _verify_chunk(directory, chunk)
+
+    with open(os.path.join(directory, chunk["file"]), "rb") as file, decompressor.stream_reader(file) as reader:
+        rest = b""
+        for block in iter(lambda: reader.read(READ_BLOCK_SIZE), b""):
+            lines = (rest + block).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                if line:
+                    yield json.loads(line)
+        if rest:
+            yield json.loads(rest)
+
+
+def export_snapshot(cache: CacheBackend, directory: str, include_rendered: bool = False, since: float = None, chunk_bytes: int = 64 * 1024 * 1024, level: int = 10) -> dict:
+    """
+    Write cached payloads (and rendered output with `include_rendered`) to `directory` as a snapshot, streaming
+    rows into chunks of about `chunk_bytes` uncompressed bytes each.
+
+    With `since`, only payloads pushed at or after that Unix time are exported, with rendered output of those posts
+    only. Pass `created_at` of the previous snapshot's manifest to get an incremental snapshot on top of it.
+    """
+    _require_zstandard()
+
+    if os.path.exists(os.path.join(directory, MANIFEST_NAME)):
+        raise ValueError(f"Snapshot already exists in {directory}")
+    os.makedirs(directory, exist_ok=True)
+
+    created_at = time.time()
+    compressor = zstandard.ZstdCompressor(level=level)
+    chunks = []
+    exported_keys = set()
+
+    writer = _ChunkWriter(directory, "cache", compressor, chunk_bytes, chunks)
+    for key, value in cache.iter_items(since=since):
+        writer.write(json.dumps([key, value]).encode("utf-8"))
+        if since is not None:
+            exported_keys.add(key)
+    writer.close()
+
+    if include_rendered:
+        writer = _ChunkWriter(directory, "rendered", compressor, chunk_bytes, chunks)
+        for key, post_id, value, compressed in cache.iter_rendered():
+            if since is not None and post_id not in exported_keys:
+                continue
+            compressed = {encoding: base64.b64encode(data).decode("ascii") for encoding, data in compressed.items()}
+            writer.write(json.dumps([key, post_id, value, compressed]).encode("utf-8"))
+        writer.close()
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": created_at,
+        "since": since,
+        "include_rendered": include_rendered,
+        "rows": sum(chunk["rows"] for chunk in chunks if chunk["kind"] == "cache"),
+        "rendered_rows": sum(chunk["rows"] for chunk in chunks if chunk["kind"] == "rendered"),
+        "chunks": chunks,
+    }
+
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    with open(manifest_path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    logger.info(f"Exported snapshot of {manifest['rows']} cached payloads and {manifest['rendered_rows']} rendered posts to {directory} in {time.time() - created_at:.1f}s")
+    return manifest
+
+
+def _import_batch(cache: CacheBackend, kind: str, batch: list, incremental: bool) -> None:
+    if kind == "cache":
+        cache.push_many([(key, value) for key, value in batch])
+        if incremental:
+            # Posts updated since previous snapshot, their local rendered output is outdated
+            cache.delete_rendered_many([key for key, _ in batch])
+    elif kind == "rendered":
+        cache.push_rendered_many([
+            (key, post_id, value, {encoding: base64.b64decode(data) for encoding, data in compressed.items()})
+            for key, post_id, value, compressed in batch
+        ])
+
+
+def import_snapshot(cache: CacheBackend, directory: str, batch_size: int = 5000) -> dict:
+    """
+    Load snapshot from `directory` into cache, `batch_size` rows per transaction. Chunks are decompressed and parsed
+    as a stream, so only one batch of rows is held in memory. Incremental snapshots are applied on top of the
+    snapshot they were exported after, in the same order.
+
+    Full snapshot defers index builds to the end of import, incremental one updates indexes as it goes. Rendered
+    chunks follow cache chunks in manifest, so rendered output of updated posts is replaced, not dropped.
+
+    Snapshots carry no deletions: posts deleted from source cache after previous snapshot stay in target cache
+    until deleted there too, or until target is bootstrapped from a full snapshot again.
+    """
+    _require_zstandard()
+
+    with open(os.path.join(directory, MANIFEST_NAME)) as file:
+        manifest = json.load(file)
+
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {manifest.get('version')}")
+
+    started_at = time.time()
+    decompressor = zstandard.ZstdDecompressor()
+
+    with cache.bulk_load(defer_indexes=manifest["since"] is None):
+        for chunk in manifest["chunks"]:
+            batch = []
+            for row in _iter_chunk(directory, chunk, decompressor):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    _import_batch(cache, chunk["kind"], batch, incremental=manifest["since"] is not None)
+                    batch = []
+            if batch:
+                _import_batch(cache, chunk["kind"], batch, incremental=manifest["since"] is not None)
+
+            logger.trace(f"Imported snapshot chunk {chunk['file']} with {chunk['rows']} rows")
+
+    logger.info(f"Imported snapshot of {manifest['rows']} cached payloads and {manifest['rendered_rows']} rendered posts from {directory} in {time.time() - started_at:.1f}s")
+    return manifest
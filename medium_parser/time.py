@@ -1,4 +1,9 @@
+from collections import deque
 from datetime import datetime
+from time import monotonic
+from typing import Optional, Union
+
+from .exceptions import DeadlineExceeded
 
 
 def convert_datetime_to_human_readable(unix_time: int):
@@ -43,3 +48,66 @@ def get_unix_ms() -> int:
     milliseconds_since_epoch = int(current_date_time.timestamp() * 1000)
 
     return milliseconds_since_epoch
+
+
+class Deadline:
+    """
+    End-to-end time budget of a request, based on monotonic clock.
+    """
+    __slots__ = ('expires_at',)
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds: float) -> 'Deadline':
+        return cls(monotonic() + seconds)
+
+    @classmethod
+    def coerce(cls, value: Union['Deadline', float, None]) -> Optional['Deadline']:
+        if value is None or isinstance(value, cls):
+            return value
+        return cls.after(value)
+
+    def remaining(self) -> float:
+        return max(self.expires_at - monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+def cap_timeout(timeout: float, deadline: Optional[Deadline]) -> float:
+    """
+    Shrink per-call timeout to what is left of the deadline.
+    """
+    if deadline is None:
+        return timeout
+
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("Deadline exceeded")
+
+    return min(timeout, remaining)
+
+
+class LatencyTracker:
+    """
+    Keeps last `window` latencies (in seconds) to estimate percentiles, e.g. delay of hedged requests.
+    """
+    __slots__ = ('samples', 'min_samples')
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+
+        ordered_samples = sorted(self.samples)
+        index = min(int(len(ordered_samples) * percent / 100), len(ordered_samples) - 1)
+        return ordered_samples[index]
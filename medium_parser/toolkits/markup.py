@@ -0,0 +1,128 @@
+"""
+Markup engine: applies Medium paragraph markups (bold, italic, code, links) and highlights to paragraph text.
+
+Markups are turned into boundary events, which are applied in a single sweep over the text. Overlapping markups
+are split by closing inner tags and reopening them, so output is always well-formed HTML. Text between boundaries
+is HTML-escaped in the same pass.
+"""
+from html import escape
+
+from loguru import logger
+
+HIGHLIGHT_MARKUP_TYPE = "HIGHLIGHT"
+
+
+def escape_html(text: str) -> str:
+    return escape(text, quote=False)
+
+
+def _markup_tags(markup: dict) -> tuple:
+    markup_type = markup["type"]
+
+    if markup_type == "STRONG":
+        return "<strong>", "</strong>"
+    elif markup_type == "EM":
+        return "<em>", "</em>"
+    elif markup_type == "CODE":
+        return '<code class="p-1">', "</code>"
+    elif markup_type == HIGHLIGHT_MARKUP_TYPE:
+        return '<mark style="background-color: rgb(200 227 200);">', "</mark>"
+    elif markup_type == "A":
+        if markup.get("anchorType") == "USER":
+            href = f"https://medium.com/u/{markup['userId']}"
+        else:
+            href = markup.get("href")
+        if not href:
+            return None
+        return f'<a style="text-decoration: underline;" rel="noopener" target="_blank" href="{escape(href)}">', "</a>"
+
+    return None
+
+
+def _utf16_offsets(text: str) -> list:
+    """
+    Medium counts markup offsets in UTF-16 code units (JS strings), map them to Python string indexes.
+    Returns None if text has no characters outside of BMP, so offsets can be used as is.
+    """
+    if text.isascii() or all(ord(char) <= 0xFFFF for char in text):
+        return None
+
+    offsets = []
+    for index, char in enumerate(text):
+        offsets.append(index)
+        if ord(char) > 0xFFFF:
+            offsets.append(index)
+    offsets.append(len(text))
+    return offsets
+
+
+def parse_markups(text: str, markups: list) -> list:
+    """
+    Convert Medium markups to (start, end, order, open_tag, close_tag) ranges in Python string indexes.
+    """
+    offsets = _utf16_offsets(text)
+    text_length = len(text)
+    ranges = []
+
+    for order, markup in enumerate(markups):
+        tags = _markup_tags(markup)
+        if tags is None:
+            logger.warning(f"Unsupported markup, ignore: {markup}")
+            continue
+
+        start, end = markup["start"], markup["end"]
+        if offsets is not None:
+            start, end = offsets[min(start, len(offsets) - 1)], offsets[min(end, len(offsets) - 1)]
+        start, end = max(start, 0), min(end, text_length)
+
+        if start >= end:
+            continue
+
+        ranges.append((start, end, order, tags[0], tags[1]))
+
+    return ranges
+
+
+def render_markup_text(text: str, markups: list = ()) -> str:
+    """
+    Render paragraph text with markups applied as escaped HTML.
+    """
+    ranges = parse_markups(text, markups)
+    if not ranges:
+        return escape_html(text)
+
+    # Outer (longer) ranges are opened first, so nested markups don't have to be split
+    ranges.sort(key=lambda markup_range: (markup_range[0], -markup_range[1], markup_range[2]))
+    boundaries = sorted({position for markup_range in ranges for position in markup_range[:2]})
+
+    out = []
+    opened = []
+    next_range = 0
+    position = 0
+
+    for boundary in boundaries:
+        if boundary > position:
+            out.append(escape_html(text[position:boundary]))
+            position = boundary
+
+        if any(markup_range[1] == boundary for markup_range in opened):
+            # Close everything up to the outermost ending range, then reopen ranges which are still going on
+            to_reopen = []
+            while any(markup_range[1] == boundary for markup_range in opened):
+                markup_range = opened.pop()
+                out.append(markup_range[4])
+                if markup_range[1] != boundary:
+                    to_reopen.append(markup_range)
+
+            for markup_range in reversed(to_reopen):
+                out.append(markup_range[3])
+                opened.append(markup_range)
+
+        while next_range < len(ranges) and ranges[next_range][0] == boundary:
+            out.append(ranges[next_range][3])
+            opened.append(ranges[next_range])
+            next_range += 1
+
+    out.append(escape_html(text[position:]))
+
+    return "".join(out)
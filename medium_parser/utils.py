@@ -1,25 +1,28 @@
+import asyncio
 import hashlib
 import secrets
 import difflib
 import urllib.parse
-from aiohttp_retry import RetryClient
 from datetime import datetime
 from loguru import logger
 from functools import lru_cache
 from urllib.parse import urlparse, parse_qs
-import aiohttp
 import string
+from typing import Optional
 
-from . import retry_options, exceptions
-
-import tld
-from bs4 import BeautifulSoup
+from . import exceptions
+from .context import MediumParserContext, get_context
+from .scheduler import Priority
+from .time import Deadline
 
 VALID_ID_CHARS = set(string.ascii_letters + string.digits)
 
 KNOWN_MEDIUM_NETLOC = ("javascript.plainenglish.io", "python.plainenglish.io", "levelup.gitconnected.com")
 KNOWN_MEDIUM_DOMAINS = ("medium.com", "towardsdatascience.com", "eand.co", "betterprogramming.pub", "curiouse.co", "betterhumans.pub", "uxdesign.cc")
 
+# Hosts which wrap or redirect to the actual post URL, so post ID can't be parsed from URL alone
+REDIRECT_NETLOCS = ("l.facebook.com", "webcache.googleusercontent.com", "www.google.com", "12ft.io", "link.medium.com")
+
 NOT_MEDIUM_DOMAINS = ("github.com", "yandex.ru", "yandex.kz", "youtube.com", "nytimes.com", "wsj.com", "reddit.com", "elpais.com", "forbes.com", "bloomberg.com")
 
 
@@ -60,6 +63,13 @@ def get_unix_ms() -> int:
     return milliseconds_since_epoch
 
 
+def parse_retry_after(value: str) -> float:
+    # Only delay-seconds form of Retry-After header is supported, HTTP-date form is ignored
+    if value and value.strip().isdigit():
+        return float(value)
+    return None
+
+
 def unquerify_url(url):
   """
   Sanitizes a URL by removing all query parameters.
@@ -102,72 +112,147 @@ def is_valid_medium_post_id_hexadecimal(hex_string: str) -> bool:
         return True
 
 
-async def resolve_medium_short_link_v1(short_url_id: str, timeout: int = 5) -> str:
+def is_valid_media_resource_id(value: str) -> bool:
+    # Iframe media resource IDs are hex digests, longer than post IDs
+    return 0 < len(value) <= 64 and all(char in VALID_ID_CHARS for char in value)
+
+
+def is_known_medium_url(url: str) -> bool:
+    """
+    Check if URL is on one of known Medium domains by its host only, without network requests or TLD lookup.
+    """
+    netloc = urlparse(url).netloc.lower()
+    return netloc in KNOWN_MEDIUM_NETLOC or any(netloc == domain or netloc.endswith("." + domain) for domain in KNOWN_MEDIUM_DOMAINS)
+
+
+def parse_medium_post_id_from_path(path: str) -> Optional[str]:
+    """
+    Get post ID from "/p/<id>" or "/<slug>-<id>" URL path. Returns None if path doesn't end with a valid post ID.
+    """
+    if path.startswith("/p/"):
+        post_id = path.rsplit("/p/")[1]
+    else:
+        post_id = path.split("/")[-1].split("-")[-1]
+
+    if not is_valid_medium_post_id_hexadecimal(post_id):
+        return None
+
+    return post_id
+
+
+def parse_medium_post_id_locally(url: str) -> Optional[str]:
+    """
+    Get post ID from URL path without any network requests. Returns None if URL needs to be resolved first.
+    """
+    parsed_url = urlparse(url)
+    if parsed_url.netloc in REDIRECT_NETLOCS or parsed_url.path.startswith("/m/global-identity-2"):
+        return None
+
+    return parse_medium_post_id_from_path(parsed_url.path)
+
+
+async def scheduled_get(session, url: str, timeout: float, context: MediumParserContext, priority: Priority, **kwargs):
+    """
+    GET with retries on 5xx and connection errors, every attempt in its own outbound scheduler slot, so each of them
+    takes a token. `timeout` bounds all attempts, including waits for slots and backoff between them.
+    Response body is read before slot is released.
+    """
+    import aiohttp
+
+    deadline = Deadline.after(timeout)
+    retry_options = context.retry_options
+
+    for attempt in range(retry_options.attempts):
+        last_attempt = attempt + 1 == retry_options.attempts
+        try:
+            async with context.scheduler.slot(priority, deadline.remaining()):
+                response = await session.get(url, timeout=aiohttp.ClientTimeout(total=max(deadline.remaining(), 0.001)), **kwargs)
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+            if last_attempt or deadline.expired:
+                raise
+            logger.debug(f"Attempt #{attempt + 1} to GET {url} failed: {ex!r}")
+        else:
+            if response.status < 500 or last_attempt:
+                return response
+            logger.debug(f"Attempt #{attempt + 1} to GET {url} failed with {response.status} status")
+
+        backoff = retry_options.get_timeout(attempt)
+        if deadline.remaining() <= backoff:
+            raise asyncio.TimeoutError(f"Timeout exceeded while getting {url}")
+        await asyncio.sleep(backoff)
+
+
+async def resolve_medium_short_link_v1(short_url_id: str, timeout: int = 5, context: MediumParserContext = None, priority: Priority = Priority.INTERACTIVE) -> str:
+    import aiohttp
+
+    context = context or get_context()
     async with aiohttp.ClientSession() as session:
-        retry_client = RetryClient(client_session=session, raise_for_status=False, retry_options=retry_options)
-        request = await retry_client.get(
+        request = await scheduled_get(
+            session,
             f"https://rsci.app.link/{short_url_id}",
-            timeout=timeout,
+            timeout,
+            context,
+            priority,
             headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.116 Safari/537.36"},
             allow_redirects=False,
         )
         post_url = request.headers["Location"]
-    return await get_medium_post_id_by_url(post_url)
+    return await get_medium_post_id_by_url(post_url, context=context, priority=priority)
 
 
-async def get_medium_post_id_by_url(url: str, timeout: int = 5) -> str:
+async def get_medium_post_id_by_url(url: str, timeout: int = 5, context: MediumParserContext = None, priority: Priority = Priority.INTERACTIVE) -> str:
     parsed_url = urlparse(url)
     if parsed_url.path.startswith("/p/"):
-        post_id = parsed_url.path.rsplit("/p/")[1]
+        return parse_medium_post_id_from_path(parsed_url.path) or False
     elif parsed_url.netloc == "l.facebook.com" and parsed_url.path.startswith("/l.php"):
         parsed_query = parse_qs(parsed_url.query)
         if parsed_query.get("u") and len(parsed_query["u"]) == 1:
             post_url = parsed_query["u"][0]
-            return await get_medium_post_id_by_url(post_url)
+            return await get_medium_post_id_by_url(post_url, context=context, priority=priority)
         return False
     elif parsed_url.netloc == "webcache.googleusercontent.com" and parsed_url.path.startswith("/search"):
         parsed_query = parse_qs(parsed_url.query)
         if parsed_query.get("q") and len(parsed_query["q"]) == 1:
             post_url = parsed_query["q"][0].removeprefix("cache:")
-            return await get_medium_post_id_by_url(post_url)
+            return await get_medium_post_id_by_url(post_url, context=context, priority=priority)
         return False
     elif parsed_url.netloc == "www.google.com" and parsed_url.path.startswith("/url"):
         parsed_query = parse_qs(parsed_url.query)
         if parsed_query.get("url") and len(parsed_query["url"]) == 1:
             post_url = parsed_query["url"][0]
-            return await get_medium_post_id_by_url(post_url)
+            return await get_medium_post_id_by_url(post_url, context=context, priority=priority)
         elif parsed_query.get("q") and len(parsed_query["q"]) == 1:
             post_url = parsed_query["q"][0]
-            return await get_medium_post_id_by_url(post_url)
+            return await get_medium_post_id_by_url(post_url, context=context, priority=priority)
         return False
     elif parsed_url.netloc == "12ft.io":
         parsed_query = parse_qs(parsed_url.query)
         if parsed_query.get("q") and len(parsed_query["q"]) == 1:
             post_url = parsed_query["q"][0]
-            return await get_medium_post_id_by_url(post_url)
+            return await get_medium_post_id_by_url(post_url, context=context, priority=priority)
         return False
     elif parsed_url.path.startswith("/m/global-identity-2"):
         parsed_query = parse_qs(parsed_url.query)
         if parsed_query.get("redirectUrl") and len(parsed_query["redirectUrl"]) == 1:
             post_url = parsed_query["redirectUrl"][0]
-            return await get_medium_post_id_by_url(post_url)
+            return await get_medium_post_id_by_url(post_url, context=context, priority=priority)
         return False
     elif parsed_url.netloc == "link.medium.com":
         short_url_id = parsed_url.path.removeprefix("/")
-        return await resolve_medium_short_link_v1(short_url_id, timeout)
-    else:
-        post_url = parsed_url.path.split("/")[-1]
-        post_id = post_url.split("-")[-1]
+        return await resolve_medium_short_link_v1(short_url_id, timeout, context, priority)
 
-    if not is_valid_medium_post_id_hexadecimal(post_id):
-        return False
+    return parse_medium_post_id_from_path(parsed_url.path) or False
 
-    return post_id
 
+async def get_medium_post_id_by_url_old(url: str, timeout: int = 5, context: MediumParserContext = None) -> str:
+    import aiohttp
+    from aiohttp_retry import RetryClient
+    from bs4 import BeautifulSoup
 
-async def get_medium_post_id_by_url_old(url: str, timeout: int = 5) -> str:
+    context = context or get_context()
     async with aiohttp.ClientSession() as session:
-        retry_client = RetryClient(client_session=session, raise_for_status=False, retry_options=retry_options)
+        retry_client = RetryClient(client_session=session, raise_for_status=False, retry_options=context.retry_options)
         request = await retry_client.get(url, timeout=timeout)
         response = await request.text()
     soup = BeautifulSoup(response, "html.parser")
@@ -185,6 +270,8 @@ async def get_medium_post_id_by_url_old(url: str, timeout: int = 5) -> str:
 
 @lru_cache(maxsize=200)
 def get_fld(url: str):
+    import tld
+
     try:
         fld = tld.get_fld(url)
     except Exception as ex:
@@ -194,7 +281,7 @@ def get_fld(url: str):
         return fld
 
 
-async def is_valid_medium_url(url: str, timeout: int = 5) -> bool:
+async def is_valid_medium_url(url: str, timeout: int = 5, context: MediumParserContext = None, priority: Priority = Priority.INTERACTIVE) -> bool:
     """
     Check if the url is a valid medium.com url
 
@@ -217,16 +304,17 @@ async def is_valid_medium_url(url: str, timeout: int = 5) -> bool:
         logger.warning(f"url '{url}' wasn't detected in known medium domains")
 
     # Second stage
-    async with aiohttp.ClientSession() as session:
-        retry_client = RetryClient(client_session=session, raise_for_status=False, retry_options=retry_options)
+    import aiohttp
+    from bs4 import BeautifulSoup
 
+    context = context or get_context()
+    async with aiohttp.ClientSession() as session:
         try:
-            request = await retry_client.get(url, timeout=timeout)
+            request = await scheduled_get(session, url, timeout, context, priority)
+            response = await request.text()
         except Exception as ex:
             raise exceptions.PageLoadingError(ex) from ex
 
-        response = await request.text()
-
     soup = BeautifulSoup(response, "html.parser")
 
     if not soup.head:
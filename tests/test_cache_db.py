@@ -0,0 +1,109 @@
+import pytest
+
+from medium_parser.cache_db import RANDOM_ORDER_MAX_ROWS, SQLiteCacheBackend
+
+
+def make_cache(tmp_path, rows: int) -> SQLiteCacheBackend:
+    cache = SQLiteCacheBackend(str(tmp_path / "cache.sqlite"))
+    cache.init_db()
+    cache.push_many([(f"key{i:06d}", f"value{i}") for i in range(rows)])
+    return cache
+
+
+def delete_rowids(cache: SQLiteCacheBackend, start: int, end: int) -> None:
+    with cache.connection:
+        cache.cursor.execute("DELETE FROM cache WHERE rowid BETWEEN :0 AND :1", {'0': start, '1': end})
+
+
+def test_random_returns_distinct_rows_after_gap(tmp_path):
+    cache = make_cache(tmp_path, 1000)
+    delete_rowids(cache, 11, 990)
+
+    sample = cache.random(15)
+
+    assert len(sample) == 15
+    assert len({key for key, _ in sample}) == 15
+
+
+def test_random_returns_whole_table_if_smaller_than_size(tmp_path):
+    cache = make_cache(tmp_path, 1000)
+    delete_rowids(cache, 11, 990)
+
+    assert sorted(cache.random(50)) == sorted(cache.all())
+
+
+def test_random_on_large_table_with_gaps_is_not_biased_to_gap_edges(tmp_path):
+    rows = RANDOM_ORDER_MAX_ROWS * 3
+    cache = make_cache(tmp_path, rows)
+    # Leave two dense ranges with a large gap between them
+    delete_rowids(cache, 5001, rows - 5000)
+
+    sample = cache.random(200)
+    keys = {key for key, _ in sample}
+
+    assert len(keys) == 200
+    first_range = sum(1 for key in keys if int(key[3:]) < 5000)
+    # Both ranges have the same size, so each should get a fair share of the sample
+    assert 50 < first_range < 150
+    # Rows right after the gap must not dominate
+    assert sum(1 for key in keys if int(key[3:]) == rows - 5000) <= 1
+
+
+def test_random_on_empty_table(tmp_path):
+    assert make_cache(tmp_path, 0).random(10) == []
+
+
+def test_stats_measures_cache_table_only(tmp_path):
+    cache = SQLiteCacheBackend(str(tmp_path / "cache.sqlite"))
+    cache.init_db()
+    value = "x" * 1000
+    cache.push_many([(f"key{i}", value) for i in range(200)])
+    # Rendered output takes most of the database file, but isn't part of compression ratio
+    cache.push_rendered_many([(f"rendered{i}", f"key{i}", "y" * 20000, {}) for i in range(200)])
+
+    # Measuring disk usage walks every page, so it's opt-in
+    assert cache.stats()["disk_bytes"] is None
+
+    stats = cache.stats(measure_disk=True)
+    assert stats["rows"] == 200
+    assert stats["total_bytes"] == 200 * len(value)
+    # Uncompressed values take about as much space on disk as their own size
+    assert 0.7 < stats["compression_ratio"] <= 1.0
+
+
+def test_search_is_opt_in_and_escapes_title_and_snippet(tmp_path):
+    post = {"data": {"post": {"title": "Templates <T> & traits", "content": {"bodyModel": {"paragraphs": [{"text": "Generic <T> bounds"}]}}}}}
+
+    cache = SQLiteCacheBackend(str(tmp_path / "plain.sqlite"))
+    cache.init_db()
+    cache.push("post", post)
+    with pytest.raises(ValueError):
+        cache.search("generic")
+
+    cache = SQLiteCacheBackend(str(tmp_path / "search.sqlite"), full_text_search=True)
+    cache.init_db()
+    cache.push("post", post)
+    [result] = cache.search("generic")
+    assert result["title"] == "Templates &lt;T&gt; &amp; traits"
+    assert result["snippet"] == "<mark>Generic</mark> &lt;T&gt; bounds"
+
+
+def test_random_with_zstd_probes_compressed_table_and_reads_sampled_values_only(tmp_path):
+    rows = RANDOM_ORDER_MAX_ROWS * 3
+    cache = make_cache(tmp_path, rows)
+    # Layout of transparent zstd compression: rows live in `_cache_zstd`, `cache` is a view decompressing them
+    with cache.connection:
+        cache.cursor.execute("ALTER TABLE cache RENAME TO _cache_zstd")
+        cache.cursor.execute("CREATE VIEW cache AS SELECT key, value FROM _cache_zstd")
+
+    queries = []
+    cache.connection.set_trace_callback(queries.append)
+    sample = cache.random(20)
+    cache.connection.set_trace_callback(None)
+
+    assert len({key for key, _ in sample}) == 20
+    assert all(value == f"value{int(key[3:])}" for key, value in sample)
+    assert not any("ORDER BY RANDOM()" in query for query in queries)
+    # Only sampled rows are read through the view
+    [view_query] = [query for query in queries if "FROM cache " in query]
+    assert "WHERE key IN" in view_query
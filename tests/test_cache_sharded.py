@@ -0,0 +1,71 @@
+import asyncio
+
+from medium_parser.cache_sharded import ShardedSQLiteCacheBackend
+
+
+def make_cache(tmp_path, **kwargs) -> ShardedSQLiteCacheBackend:
+    cache = ShardedSQLiteCacheBackend(str(tmp_path / "cache.sqlite"), shards=3, **kwargs)
+    cache.init_db()
+    return cache
+
+
+def test_push_outside_event_loop_is_written_through(tmp_path):
+    writer = make_cache(tmp_path)
+    reader = make_cache(tmp_path)
+
+    writer.push("key", "value")
+
+    assert str(reader.pull("key")) == "value"
+
+
+def test_queued_push_is_flushed_after_interval(tmp_path):
+    writer = make_cache(tmp_path, flush_interval=0.05)
+    reader = make_cache(tmp_path)
+
+    async def main():
+        writer.push("key", "value")
+        assert str(writer.pull("key")) == "value"
+        assert reader.pull("key") is None
+
+        await asyncio.sleep(0.2)
+        assert str(reader.pull("key")) == "value"
+
+    asyncio.run(main())
+
+
+def test_close_flushes_queued_pushes(tmp_path):
+    writer = make_cache(tmp_path, flush_interval=60)
+    reader = make_cache(tmp_path)
+
+    async def main():
+        writer.push("key", "value")
+
+    asyncio.run(main())
+    writer.close()
+
+    assert str(reader.pull("key")) == "value"
+
+
+def test_queued_replace_post_drops_outdated_rendered_variants_on_flush(tmp_path):
+    writer = make_cache(tmp_path, flush_interval=60)
+    reader = make_cache(tmp_path)
+    writer.push("post", "old")
+    writer.push_rendered("post:html", "post", "rendered old")
+    writer.push_rendered("post:html:minified", "post", "minified old")
+
+    async def main():
+        writer.replace_post("post", "new")
+        # Outdated variants aren't served by this process, others see old post until flush
+        assert writer.pull_rendered("post:html") is None
+        assert str(reader.pull_rendered("post:html")) == "rendered old"
+
+        writer.push_rendered("post:html", "post", "rendered new", {"gzip": b"\x1f\x8b"})
+        assert str(writer.pull_rendered("post:html")) == "rendered new"
+
+    asyncio.run(main())
+    writer.flush()
+
+    assert str(reader.pull("post")) == "new"
+    assert str(reader.pull_rendered("post:html")) == "rendered new"
+    assert reader.pull_rendered("post:html").compressed == {"gzip": b"\x1f\x8b"}
+    assert reader.pull_rendered("post:html:minified") is None
@@ -0,0 +1,167 @@
+import asyncio
+import gzip
+import os
+import time
+
+import pytest
+
+from medium_parser import MediumParserContext
+from medium_parser import core
+from medium_parser.cache_db import MemoryCacheBackend
+from medium_parser.core import MediumParser
+from medium_parser.exceptions import DeadlineExceeded, MediumPostQueryError
+
+
+def test_speculative_query_is_bounded_by_query_deadline(monkeypatch):
+    async def query_post_by_id(post_id, timeout, context, deadline=None, priority=None):
+        await asyncio.sleep(10)
+
+    async def is_valid_medium_url(url, timeout, context, priority):
+        return True
+
+    monkeypatch.setattr(core, "query_post_by_id", query_post_by_id)
+    monkeypatch.setattr(core, "is_valid_medium_url", is_valid_medium_url)
+    context = MediumParserContext(cache=MemoryCacheBackend())
+
+    async def main():
+        parser = await MediumParser.from_url("https://blog.example.com/some-title-abcdef123456", 3, "host", context, speculative=True)
+        with pytest.raises(DeadlineExceeded):
+            await parser.query(deadline=0.05)
+
+    asyncio.run(main())
+
+
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates")
+
+
+def make_post(post_id: str, title: str) -> dict:
+    return {"data": {"post": {
+        "id": post_id,
+        "title": title,
+        "previewContent": {"subtitle": "Notes on async runtimes"},
+        "previewImage": {"id": "preview.png"},
+        "creator": {"id": "1a2b3c4d5e6f", "name": "Author", "username": "author", "bio": "Bio", "imageId": "avatar.png"},
+        "collection": None,
+        "mediumUrl": f"https://medium.com/p/{post_id}",
+        "readingTime": 3.2,
+        "isLocked": False,
+        "updatedAt": 1700000000000,
+        "firstPublishedAt": 1690000000000,
+        "tags": [{"displayTitle": "Python", "normalizedTagSlug": "python"}],
+        "highlights": [],
+        "content": {"bodyModel": {"paragraphs": [
+            {"name": "0001", "type": "P", "text": "Futures are polled by the executor.", "markups": [{"type": "STRONG", "start": 0, "end": 7}], "layout": None},
+            {"name": "0002", "type": "P", "text": "Wakers tell it when to poll again.", "markups": [], "layout": None},
+        ]}},
+    }}}
+
+
+def make_parser(context: MediumParserContext) -> MediumParser:
+    return MediumParser("abcdef123456", 3, "host", context)
+
+
+def test_render_cache_hit_matches_fresh_render(monkeypatch):
+    pytest.importorskip("minify_html")
+    context = MediumParserContext(cache=MemoryCacheBackend())
+    context.cache.push("abcdef123456", make_post("abcdef123456", "Async in Rust"))
+
+    async def main():
+        parser = make_parser(context)
+        await parser.query()
+        first = await parser.render_as_html(TEMPLATE_FOLDER, minify=True, encodings=("gzip",))
+        fresh = await parser.render_as_html(TEMPLATE_FOLDER, minify=True, encodings=("gzip",), use_cache=False)
+
+        async def render_again(self, template_folder):
+            raise AssertionError("Cached post is rendered again")
+
+        monkeypatch.setattr(MediumParser, "_render_as_html", render_again)
+        cached = await make_parser(context).render_as_html(TEMPLATE_FOLDER, minify=True, encodings=("gzip",))
+        return first, fresh, cached
+
+    first, fresh, cached = asyncio.run(main())
+
+    assert "Async in Rust" in first.data
+    assert cached == fresh == first
+    assert gzip.decompress(cached.compressed["gzip"]).decode("utf-8") == cached.data
+
+
+def test_render_cache_is_dropped_when_post_is_queried_again(monkeypatch):
+    pytest.importorskip("minify_html")
+
+    async def query_post_by_id(post_id, timeout, context, deadline=None, priority=None):
+        return make_post(post_id, "Async in Rust, updated")
+
+    monkeypatch.setattr(core, "query_post_by_id", query_post_by_id)
+    context = MediumParserContext(cache=MemoryCacheBackend())
+    context.cache.push("abcdef123456", make_post("abcdef123456", "Async in Rust"))
+
+    async def main():
+        parser = make_parser(context)
+        await parser.query()
+        outdated = await parser.render_as_html(TEMPLATE_FOLDER, minify=True)
+
+        # Fresh post data replaces cached payload and its rendered variants
+        parser = make_parser(context)
+        await parser.query(use_cache=False)
+        assert context.cache.pull_rendered(parser._render_cache_key(TEMPLATE_FOLDER, True)) is None
+        return outdated, await parser.render_as_html(TEMPLATE_FOLDER, minify=True)
+
+    outdated, updated = asyncio.run(main())
+
+    assert "updated" not in outdated.data
+    assert "Async in Rust, updated" in updated.data
+
+
+def count_api_queries(monkeypatch, response: dict) -> list:
+    queried = []
+
+    async def query_post_by_id(post_id, timeout, context, deadline=None, priority=None):
+        queried.append(post_id)
+        return response
+
+    monkeypatch.setattr(core, "query_post_by_id", query_post_by_id)
+    return queried
+
+
+def query_twice(context: MediumParserContext) -> None:
+    async def main():
+        for _ in range(2):
+            with pytest.raises(MediumPostQueryError):
+                await make_parser(context).query()
+
+    asyncio.run(main())
+
+
+def test_unqueryable_post_is_negatively_cached(monkeypatch):
+    queried = count_api_queries(monkeypatch, {"data": {"post": None}})
+    context = MediumParserContext(cache=MemoryCacheBackend())
+
+    query_twice(context)
+
+    assert queried == ["abcdef123456"]
+    assert context.negative_cache_hits == 1
+    assert context.metrics()["negative_cache_hits"] == 1
+    assert context.cache.pull_negative("abcdef123456") == "no post in response"
+
+
+def test_negative_cache_entry_expires(monkeypatch):
+    queried = count_api_queries(monkeypatch, {"errors": [{"message": "Post not found"}], "data": {"post": None}})
+    context = MediumParserContext(cache=MemoryCacheBackend(), negative_cache_ttl=0.05)
+
+    query_twice(context)
+    time.sleep(0.1)
+    query_twice(context)
+
+    assert queried == ["abcdef123456", "abcdef123456"]
+    assert context.negative_cache_hits == 2
+
+
+def test_zero_negative_cache_ttl_disables_negative_cache(monkeypatch):
+    queried = count_api_queries(monkeypatch, {"data": {"post": None}})
+    context = MediumParserContext(cache=MemoryCacheBackend(), negative_cache_ttl=0)
+
+    query_twice(context)
+
+    assert queried == ["abcdef123456", "abcdef123456"]
+    assert context.negative_cache_hits == 0
+    assert context.cache.pull_negative("abcdef123456") is None
@@ -0,0 +1,50 @@
+from medium_parser import credentials
+from medium_parser.credentials import AuthCredential, CredentialPool
+from medium_parser.scheduler import Priority
+
+
+def test_benched_account_gets_single_trial_request(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(credentials.time, "monotonic", lambda: now[0])
+    pool = CredentialPool([AuthCredential("uid=1", "main")], bench_time=60, trial_time=30)
+    [credential] = pool.credentials
+
+    pool.report(credential, 429)
+    assert pool._try_acquire(now[0])[0] is None
+
+    # Bench expired: one trial request, nothing else until it's reported
+    now[0] += 61
+    assert pool._try_acquire(now[0])[0] is credential
+    assert credential.on_trial
+    assert pool._try_acquire(now[0])[0] is None
+
+    # Failed trial benches account again right away, for twice as long
+    pool.report(credential, 403)
+    assert not credential.on_trial
+    assert credential.benched_until == now[0] + 120
+
+    # Trial which is never reported expires, and the next request is another trial
+    now[0] += 121
+    assert pool._try_acquire(now[0])[0] is credential
+    now[0] += 31
+    assert pool._try_acquire(now[0])[0] is credential
+    assert credential.on_trial
+
+    # Successful trial brings account back
+    pool.report(credential, 200)
+    assert not credential.on_trial and credential.consecutive_benches == 0
+    assert pool._try_acquire(now[0])[0] is credential
+    assert pool._try_acquire(now[0])[0] is credential
+
+
+def test_background_requests_keep_interactive_reserve():
+    pool = CredentialPool([AuthCredential("uid=1", "main")], max_requests_per_minute=4, interactive_reserve=0.25)
+    now = 1000.0
+
+    assert [pool._try_acquire(now, Priority.PREWARM)[0] is not None for _ in range(4)] == [True, True, True, False]
+    assert pool._try_acquire(now, Priority.REFRESH)[0] is None
+    assert pool._try_acquire(now, Priority.INTERACTIVE)[0] is not None
+    assert pool._try_acquire(now, Priority.INTERACTIVE)[0] is None
+
+    # Single request per minute isn't reserved, background work would never run otherwise
+    assert CredentialPool([AuthCredential("uid=2", "other")], max_requests_per_minute=1).requests_per_minute(Priority.PREWARM) == 1
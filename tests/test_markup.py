@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+from medium_parser.toolkits.markup import HIGHLIGHT_MARKUP_TYPE, render_markup_text
+
+with open(os.path.join(os.path.dirname(__file__), "fixtures", "markup_paragraphs.json"), encoding="utf-8") as file:
+    PARAGRAPHS = json.load(file)
+
+
+@pytest.mark.parametrize("case", PARAGRAPHS, ids=[case["name"] for case in PARAGRAPHS])
+def test_render_markup_text_matches_fixture(case):
+    paragraph = case["paragraph"]
+    assert render_markup_text(paragraph["text"], paragraph["markups"]) == case["expected"]
+
+
+def render_with_rl_string_helper(paragraph: dict) -> str:
+    """
+    Paragraph text rendered the way core.py did before the markup engine, with rl-string-helper
+    (https://github.com/Freedium-cfd/rl-string-helper) on PYTHONPATH.
+    """
+    rl_string_helper = pytest.importorskip("rl_string_helper.rl_string_helper")
+
+    text_formater = rl_string_helper.RLStringHelper(paragraph["text"])
+    markups = [markup for markup in paragraph["markups"] if markup["type"] != HIGHLIGHT_MARKUP_TYPE]
+    for markup in rl_string_helper.split_overlapping_ranges(rl_string_helper.parse_markups(markups)):
+        text_formater.set_template(markup["start"], markup["end"], markup["template"])
+    for highlight in paragraph["markups"]:
+        if highlight["type"] == HIGHLIGHT_MARKUP_TYPE:
+            text_formater.set_template(highlight["start"], highlight["end"], '<mark style="background-color: rgb(200 227 200);">{{ text }}</mark>')
+    return text_formater.get_text()
+
+
+@pytest.mark.parametrize("case", PARAGRAPHS, ids=[case["name"] for case in PARAGRAPHS])
+def test_fixture_matches_rl_string_helper_except_known_differences(case):
+    rendered = render_with_rl_string_helper(case["paragraph"])
+
+    if "known_difference" in case:
+        # Keeps the list of known differences accurate: fixture must be dropped from it once engines agree
+        assert rendered != case["expected"], case["known_difference"]
+    else:
+        assert rendered == case["expected"]
@@ -0,0 +1,30 @@
+import asyncio
+
+from medium_parser import MediumParserContext
+from medium_parser import media_resources
+from medium_parser.cache_db import MemoryCacheBackend
+from medium_parser.media_resources import get_media_resource
+
+
+def test_get_media_resource_caches_next_to_cached_post_only(monkeypatch):
+    async def query_media_resources(ids, timeout, context, deadline=None, priority=None):
+        return {media_resource_id: {"id": media_resource_id, "iframeSrc": f"https://example.com/{media_resource_id}"} for media_resource_id in ids}
+
+    monkeypatch.setattr(media_resources, "query_media_resources", query_media_resources)
+    cache = MemoryCacheBackend()
+    cache.push("0123456789ab", {"data": {"post": {"id": "0123456789ab"}}})
+    context = MediumParserContext(cache=cache)
+
+    async def main():
+        assert (await get_media_resource("owned", "0123456789ab", context=context))["id"] == "owned"
+        assert (await get_media_resource("orphan", context=context))["id"] == "orphan"
+        assert (await get_media_resource("unknown_post", "fedcba654321", context=context))["id"] == "unknown_post"
+
+    asyncio.run(main())
+
+    assert cache.pull_media_resource("owned")
+    assert not cache.pull_media_resource("orphan")
+    assert not cache.pull_media_resource("unknown_post")
+
+    cache.delete_media_resources("0123456789ab")
+    assert not cache.pull_media_resource("owned")
@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import pytest
+
+from medium_parser import MediumParserContext
+from medium_parser import medium_api
+from medium_parser.cache_db import MemoryCacheBackend
+from medium_parser.credentials import AuthCredential, CredentialPool
+from medium_parser.exceptions import DeadlineExceeded, MediumPostQueryError
+from medium_parser.medium_api import query_post_by_id
+from medium_parser.scheduler import Priority
+
+
+def make_context() -> MediumParserContext:
+    return MediumParserContext(cache=MemoryCacheBackend(), retry_attempts=1, auth_cookies="uid=1")
+
+
+def test_deadline_running_out_in_last_attempt_raises_deadline_exceeded(monkeypatch):
+    async def graphql_request(session, json_data, timeout, context, priority):
+        await asyncio.sleep(timeout)
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(medium_api, "_graphql_request", graphql_request)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(query_post_by_id("abcdef123456", 3, make_context(), deadline=0.05))
+
+
+def test_failed_attempts_within_deadline_raise_query_error(monkeypatch):
+    async def graphql_request(session, json_data, timeout, context, priority):
+        raise medium_api.RetryableResponseError(503)
+
+    monkeypatch.setattr(medium_api, "_graphql_request", graphql_request)
+    with pytest.raises(MediumPostQueryError):
+        asyncio.run(query_post_by_id("abcdef123456", 3, make_context(), deadline=5))
+
+
+def test_waiting_for_rate_limited_account_does_not_hold_scheduler_slot(monkeypatch):
+    context = make_context()
+    context.credential_pool.max_requests_per_minute = 1
+    context.scheduler.max_concurrency = 1
+    sent = []
+
+    async def send_graphql_request(session, json_data, timeout, context, credential):
+        sent.append(json_data["variables"]["postId"])
+        return {"data": {"post": {"id": json_data["variables"]["postId"]}}}
+
+    monkeypatch.setattr(medium_api, "_send_graphql_request", send_graphql_request)
+
+    async def main():
+        await query_post_by_id("abcdef123456", 3, context)
+        # Only account is rate limited for a minute, this query waits for it
+        waiting = asyncio.ensure_future(query_post_by_id("abcdef654321", 3, context))
+        await asyncio.sleep(0.05)
+        assert context.scheduler._in_flight == 0
+        waiting.cancel()
+
+    asyncio.run(main())
+    assert sent == ["abcdef123456"]
+
+
+def test_background_queries_leave_account_budget_for_interactive(monkeypatch):
+    context = MediumParserContext(cache=MemoryCacheBackend(), retry_attempts=1, credential_pool=CredentialPool([AuthCredential("uid=1", "main")], max_requests_per_minute=3))
+    sent = []
+
+    async def send_graphql_request(session, json_data, timeout, context, credential):
+        sent.append(json_data["variables"]["postId"])
+        return {"data": {"post": {"id": json_data["variables"]["postId"]}}}
+
+    monkeypatch.setattr(medium_api, "_send_graphql_request", send_graphql_request)
+
+    async def main():
+        prewarm = await asyncio.gather(*(query_post_by_id(f"abcdef12345{i}", 0.2, context, priority=Priority.PREWARM) for i in range(3)), return_exceptions=True)
+        assert sum(isinstance(result, MediumPostQueryError) for result in prewarm) == 1
+
+        started_at = time.monotonic()
+        assert await query_post_by_id("fedcba654321", 3, context, priority=Priority.INTERACTIVE)
+        assert time.monotonic() - started_at < 1
+
+    asyncio.run(main())
+    assert sent[-1] == "fedcba654321"
+
+
+def make_hedging_context(hedge_delay: float) -> MediumParserContext:
+    context = MediumParserContext(cache=MemoryCacheBackend(), hedge_requests=True, hedge_percentile=95)
+    for _ in range(context.api_latency.min_samples):
+        context.api_latency.record(hedge_delay)
+    return context
+
+
+def test_hedged_request_fires_after_percentile_delay_and_cancels_slower_one(monkeypatch):
+    started_at = []
+    cancelled = []
+
+    async def graphql_request(session, json_data, timeout, context, priority):
+        started_at.append(time.monotonic())
+        attempt = len(started_at)
+        try:
+            # First request is stuck, hedged one responds right away
+            await asyncio.sleep(10 if attempt == 1 else 0)
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return {"attempt": attempt}
+
+    monkeypatch.setattr(medium_api, "_graphql_request", graphql_request)
+
+    async def main():
+        result = await medium_api._hedged_graphql_request(None, {}, 3, make_hedging_context(0.05), Priority.INTERACTIVE)
+        # Let cancellation reach the loser
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == {"attempt": 2}
+    assert 0.05 <= started_at[1] - started_at[0] < 1
+    assert cancelled == [1]
+
+
+def test_hedged_request_raises_failure_before_hedge_delay(monkeypatch):
+    calls = []
+
+    async def graphql_request(session, json_data, timeout, context, priority):
+        calls.append(priority)
+        raise medium_api.RetryableResponseError(503)
+
+    monkeypatch.setattr(medium_api, "_graphql_request", graphql_request)
+
+    with pytest.raises(medium_api.RetryableResponseError):
+        asyncio.run(medium_api._hedged_graphql_request(None, {}, 3, make_hedging_context(0.5), Priority.INTERACTIVE))
+    # Failed before hedge delay, so no hedged request was fired
+    assert calls == [Priority.INTERACTIVE]
@@ -0,0 +1,52 @@
+import gzip
+
+import pytest
+
+from medium_parser.minify import compress_html_string, minify_html_string, postprocess_html_result
+from medium_parser.models.html_result import HtmlResult
+
+HTML = """<div class="post">
+    <p class="leading-8">First   paragraph</p>
+    <p class="leading-8">Second paragraph</p>
+</div>
+"""
+
+
+def test_minify_keeps_closing_tags():
+    pytest.importorskip("minify_html")
+
+    minified = minify_html_string(HTML)
+
+    assert len(minified) < len(HTML)
+    assert "\n" not in minified
+    # Rendered post is embedded into a base template, so tags must stay closed
+    assert minified.count("</p>") == 2
+    assert minified.endswith("</div>")
+
+
+def test_compress_round_trips_each_encoding():
+    brotli = pytest.importorskip("brotli")
+
+    compressed = compress_html_string(HTML, ("gzip", "br"))
+
+    assert gzip.decompress(compressed["gzip"]).decode("utf-8") == HTML
+    assert brotli.decompress(compressed["br"]).decode("utf-8") == HTML
+    # Fixed mtime, so the same HTML always gets the same bytes
+    assert compress_html_string(HTML, ("gzip",))["gzip"] == compressed["gzip"]
+
+
+def test_compress_rejects_unknown_encoding():
+    with pytest.raises(ValueError, match="Unsupported encoding"):
+        compress_html_string(HTML, ("deflate",))
+
+
+def test_postprocess_compresses_minified_html():
+    pytest.importorskip("minify_html")
+    result = HtmlResult("Title", "Description", "https://medium.com/p/abcdef123456", HTML)
+
+    processed = postprocess_html_result(result, minify=True, encodings=("gzip",))
+
+    assert processed.data == minify_html_string(HTML)
+    assert gzip.decompress(processed.compressed["gzip"]).decode("utf-8") == processed.data
+    assert (processed.title, processed.url) == (result.title, result.url)
+    assert result.compressed == {}
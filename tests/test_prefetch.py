@@ -0,0 +1,50 @@
+import asyncio
+
+from medium_parser import MediumParserContext
+from medium_parser import prefetch
+from medium_parser.cache_sharded import ShardedSQLiteCacheBackend
+from medium_parser.prefetch import LinkPrefetcher, extract_linked_post_ids
+
+
+def make_post(post_id: str) -> dict:
+    return {"data": {"post": {"id": post_id, "title": "Title"}}}
+
+
+def test_extract_linked_post_ids_keeps_medium_links_only():
+    paragraph = {
+        "type": "MIXTAPE_EMBED",
+        "mixtapeMetadata": {"href": "https://medium.com/p/fedcba654321"},
+        "markups": [
+            {"type": "A", "href": "https://github.com/user/repo-0123456789ab"},
+            {"type": "A", "href": "https://towardsdatascience.com/some-title-abcdef012345"},
+            {"type": "A", "anchorType": "USER", "userId": "abcdef012345"},
+        ],
+    }
+
+    assert extract_linked_post_ids(paragraph) == ["fedcba654321", "abcdef012345"]
+
+
+def test_prefetched_post_is_visible_to_other_workers(tmp_path, monkeypatch):
+    async def query_post_by_id(post_id, timeout, context, priority=None):
+        return make_post(post_id) if post_id != "0123456789ab" else {"data": {"post": None}}
+
+    monkeypatch.setattr(prefetch, "query_post_by_id", query_post_by_id)
+
+    worker_cache = ShardedSQLiteCacheBackend(str(tmp_path / "cache.sqlite"), shards=2, flush_interval=0.05)
+    worker_cache.init_db()
+    other_worker_cache = ShardedSQLiteCacheBackend(str(tmp_path / "cache.sqlite"), shards=2)
+    context = MediumParserContext(cache=worker_cache, auth_cookies="cookies")
+    prefetcher = LinkPrefetcher(context)
+
+    async def main():
+        prefetcher.schedule("abcdef123456", ["fedcba654321", "0123456789ab"])
+        await prefetcher.wait()
+        # Queued like any other write, and flushed within flush interval
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+
+    assert other_worker_cache.pull("fedcba654321").json() == make_post("fedcba654321")
+    assert worker_cache.pull_negative("0123456789ab") == "no post in response"
+    assert prefetcher.metrics()["fetched"] == 1
+    assert prefetcher.metrics()["failed"] == 1
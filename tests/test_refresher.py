@@ -0,0 +1,90 @@
+import asyncio
+import json
+import time
+from collections import Counter
+
+from medium_parser import MediumParserContext
+from medium_parser import refresher as refresher_module
+from medium_parser.cache_db import INITIAL_REFRESH_DELAY, MAX_INITIAL_REFRESH_DELAY, SQLiteCacheBackend
+from medium_parser.refresher import CacheRefresher
+
+
+def make_post(post_id: str, updated_at: int) -> dict:
+    return {"data": {"post": {"id": post_id, "updatedAt": updated_at}}}
+
+
+def make_cache(tmp_path) -> SQLiteCacheBackend:
+    cache = SQLiteCacheBackend(str(tmp_path / "cache.sqlite"))
+    cache.init_db()
+    return cache
+
+
+def make_due(cache: SQLiteCacheBackend, keys: list) -> None:
+    schedule = cache.pull_refresh_schedule(keys)
+    cache.push_refresh_schedule([(key, *schedule[key][:3], 0) for key in keys])
+
+
+def test_push_schedules_first_refresh(tmp_path):
+    cache = make_cache(tmp_path)
+    now = time.time()
+
+    cache.push("abcdef123456", make_post("abcdef123456", int(now * 1000)))
+    hits, post_updated_at, _, next_refresh_at = cache.pull_refresh_schedule(["abcdef123456"])["abcdef123456"]
+
+    assert (hits, post_updated_at) == (0, int(now * 1000) / 1000)
+    assert now + INITIAL_REFRESH_DELAY <= next_refresh_at <= now + 2 * INITIAL_REFRESH_DELAY + 1
+
+
+def test_first_refresh_of_old_posts_is_weighted_by_age(tmp_path):
+    cache = make_cache(tmp_path)
+    now = time.time()
+    updated_at_2017 = 1500000000000
+
+    # Payloads loaded from snapshot are serialized
+    cache.push_many([(f"abcdef12{i:04d}", json.dumps(make_post(f"abcdef12{i:04d}", updated_at_2017))) for i in range(100)])
+    cache.push("fedcba654321", make_post("fedcba654321", updated_at_2017))
+    cache.push("0123456789ab", "not a post")
+
+    assert cache.due_refreshes(now + 2 * INITIAL_REFRESH_DELAY + 1, 1000) == ["0123456789ab"]
+    schedule = cache.pull_refresh_schedule(["abcdef120000", "fedcba654321"])
+    assert {row[1] for row in schedule.values()} == {updated_at_2017 / 1000}
+    assert all(row[3] >= now + MAX_INITIAL_REFRESH_DELAY for row in schedule.values())
+
+
+def test_hits_of_other_processes_reach_schedule(tmp_path):
+    web_context = MediumParserContext(cache=make_cache(tmp_path), auth_cookies="cookies")
+    refresher_cache = make_cache(tmp_path)
+    web_context.cache.push("abcdef123456", make_post("abcdef123456", 1))
+
+    for _ in range(3):
+        web_context.record_post_access("abcdef123456")
+    web_context.flush_post_hits()
+
+    assert refresher_cache.pull_refresh_schedule(["abcdef123456"])["abcdef123456"][0] == 3
+
+
+def test_concurrent_refreshers_claim_each_post_once(tmp_path, monkeypatch):
+    queried = Counter()
+
+    async def query_post_by_id(post_id, timeout, context, priority=None):
+        queried[post_id] += 1
+        await asyncio.sleep(0.01)
+        return make_post(post_id, 2000)
+
+    monkeypatch.setattr(refresher_module, "query_post_by_id", query_post_by_id)
+
+    keys = [f"abcdef12345{i}" for i in range(6)]
+    cache = make_cache(tmp_path)
+    cache.push_many([(key, make_post(key, 1000)) for key in keys])
+    make_due(cache, keys)
+
+    refreshers = [CacheRefresher(MediumParserContext(cache=make_cache(tmp_path), auth_cookies="cookies")) for _ in range(2)]
+
+    async def main():
+        await asyncio.gather(*(refresher.refresh_due() for refresher in refreshers))
+
+    asyncio.run(main())
+
+    assert queried == Counter({key: 1 for key in keys})
+    assert sum(refresher.updated for refresher in refreshers) == len(keys)
+    assert cache.due_refreshes(time.time(), 10) == []
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import pytest
+
+from medium_parser import MediumParserContext
+from medium_parser.cache_db import MemoryCacheBackend
+from medium_parser.scheduler import OutboundScheduler, Priority
+from medium_parser.utils import scheduled_get
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    async def main():
+        scheduler = OutboundScheduler(max_concurrency=1, rate=1000, burst=1000)
+        await scheduler.acquire(Priority.INTERACTIVE)
+
+        served = []
+
+        async def request(name, priority):
+            async with scheduler.slot(priority):
+                served.append(name)
+
+        tasks = [asyncio.ensure_future(request(name, priority)) for name, priority in (
+            ("prewarm", Priority.PREWARM),
+            ("refresh", Priority.REFRESH),
+            ("interactive-1", Priority.INTERACTIVE),
+            ("interactive-2", Priority.INTERACTIVE),
+        )]
+        await asyncio.sleep(0.01)
+        assert scheduler.metrics()["queue_depth"] == {"interactive": 2, "refresh": 1, "prewarm": 1}
+
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        assert served == ["interactive-1", "interactive-2", "refresh", "prewarm"]
+
+        metrics = scheduler.metrics()
+        assert metrics["in_flight"] == 0
+        assert metrics["queue_depth"] == {"interactive": 0, "refresh": 0, "prewarm": 0}
+        assert metrics["requests"] == {"interactive": 3, "refresh": 1, "prewarm": 1}
+        assert metrics["wait_time_p95"]["prewarm"] > 0
+
+    asyncio.run(main())
+
+
+def test_token_bucket_limits_request_rate():
+    async def main():
+        scheduler = OutboundScheduler(max_concurrency=100, rate=50, burst=2)
+        started_at = time.monotonic()
+        for _ in range(5):
+            async with scheduler.slot():
+                pass
+        # Burst of 2 goes right away, the other 3 wait for a token each
+        return time.monotonic() - started_at
+
+    assert 0.05 <= asyncio.run(main()) < 0.5
+
+
+def test_slot_wait_is_bounded_by_timeout():
+    async def main():
+        scheduler = OutboundScheduler(max_concurrency=1)
+        await scheduler.acquire()
+        with pytest.raises(asyncio.TimeoutError):
+            async with scheduler.slot(Priority.INTERACTIVE, timeout=0.05):
+                pass
+        assert scheduler.metrics()["queue_depth"]["interactive"] == 0
+
+    asyncio.run(main())
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+
+    async def read(self):
+        return b""
+
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+
+    async def get(self, url, timeout, **kwargs):
+        return FakeResponse(self.statuses.pop(0))
+
+
+def test_scheduled_get_takes_a_token_per_attempt():
+    context = MediumParserContext(cache=MemoryCacheBackend(), retry_attempts=3, scheduler=OutboundScheduler())
+
+    async def main():
+        return await scheduled_get(FakeSession([503, 502, 200]), "https://example.com", 10, context, Priority.INTERACTIVE)
+
+    assert asyncio.run(main()).status == 200
+    assert context.scheduler.metrics()["requests"]["interactive"] == 3
+
+
+def test_scheduled_get_does_not_wait_for_saturated_scheduler_past_timeout():
+    context = MediumParserContext(cache=MemoryCacheBackend(), scheduler=OutboundScheduler(max_concurrency=1))
+
+    async def main():
+        await context.scheduler.acquire()
+        started_at = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await scheduled_get(FakeSession([200]), "https://example.com", 0.1, context, Priority.INTERACTIVE)
+        return time.monotonic() - started_at
+
+    assert asyncio.run(main()) < 1
@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip("zstandard")
+
+from medium_parser.cache_db import SQLiteCacheBackend
+from medium_parser.snapshot import export_snapshot, import_snapshot
+
+
+def make_cache(tmp_path, name: str) -> SQLiteCacheBackend:
+    cache = SQLiteCacheBackend(str(tmp_path / name))
+    cache.init_db()
+    return cache
+
+
+def test_full_and_incremental_snapshot(tmp_path):
+    source = make_cache(tmp_path, "source.sqlite")
+    source.push_many([(f"post{i}", f"value{i}") for i in range(10)])
+    source.push_rendered("post1:html", "post1", "rendered1", {"gzip": b"\x1f\x8b"})
+    source.push_rendered("post2:html", "post2", "rendered2")
+    full = export_snapshot(source, str(tmp_path / "full"), include_rendered=True, chunk_bytes=40)
+    # Each row takes 20 bytes, so chunks get 2 rows each
+    assert [chunk["rows"] for chunk in full["chunks"] if chunk["kind"] == "cache"] == [2] * 5
+
+    source.replace_post("post1", "value1-updated")
+    incremental = export_snapshot(source, str(tmp_path / "incremental"), include_rendered=True, since=full["created_at"])
+    assert incremental["rows"] == 1
+
+    target = make_cache(tmp_path, "target.sqlite")
+    import_snapshot(target, str(tmp_path / "full"))
+    assert target.all_length() == 10
+    assert target.pull_rendered("post1:html").compressed == {"gzip": b"\x1f\x8b"}
+
+    import_snapshot(target, str(tmp_path / "incremental"))
+    assert str(target.pull("post1")) == "value1-updated"
+    # Outdated rendered output of updated post is dropped, the rest is kept
+    assert target.pull_rendered("post1:html") is None
+    assert str(target.pull_rendered("post2:html")) == "rendered2"
+
+
+def test_incremental_load_keeps_rendered_index(tmp_path):
+    cache = make_cache(tmp_path, "cache.sqlite")
+
+    with cache.bulk_load(defer_indexes=False):
+        plan = cache.cursor.execute("EXPLAIN QUERY PLAN DELETE FROM rendered WHERE post_id = 'post'").fetchall()
+
+    assert "rendered_post_id" in str(plan)
+
+
+def test_corrupted_chunk_is_rejected_before_import(tmp_path):
+    source = make_cache(tmp_path, "source.sqlite")
+    source.push_many([(f"post{i}", f"value{i}") for i in range(10)])
+    manifest = export_snapshot(source, str(tmp_path / "full"), chunk_bytes=40)
+
+    path = tmp_path / "full" / manifest["chunks"][1]["file"]
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    target = make_cache(tmp_path, "target.sqlite")
+    with pytest.raises(ValueError, match="corrupted"):
+        import_snapshot(target, str(tmp_path / "full"))
+    # Rows of the intact first chunk only, none of the corrupted one
+    assert target.all_length() == manifest["chunks"][0]["rows"]
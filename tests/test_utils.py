@@ -0,0 +1,22 @@
+import asyncio
+
+import pytest
+
+from medium_parser.utils import get_medium_post_id_by_url, parse_medium_post_id_locally
+
+
+@pytest.mark.parametrize("url, post_id", [
+    ("https://medium.com/p/abcdef123456", "abcdef123456"),
+    ("https://medium.com/@author/some-title-abcdef123456", "abcdef123456"),
+    ("https://blog.example.com/some-title-abcdef123456", "abcdef123456"),
+    ("https://medium.com/@author/some-title-zz", None),
+])
+def test_post_id_parsed_locally_and_by_url_agree(url, post_id):
+    assert parse_medium_post_id_locally(url) == post_id
+    assert asyncio.run(get_medium_post_id_by_url(url)) == (post_id or False)
+
+
+def test_redirect_urls_need_resolving():
+    url = "https://www.google.com/url?q=https://medium.com/@author/some-title-abcdef123456"
+    assert parse_medium_post_id_locally(url) is None
+    assert asyncio.run(get_medium_post_id_by_url(url)) == "abcdef123456"